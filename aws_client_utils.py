@@ -0,0 +1,50 @@
+"""
+Helper functions shared by the AWS service clients
+"""
+
+import threading
+
+# boto clients make a single attempt per call: throttling and retries are owned by the callers'
+# backoff loop (aws_workspace_utils.call_with_backoff) and its adaptive rate limiters, so that
+# a throttled call is never retried by both layers and every throttle reaches the limiter
+BOTO_MAX_ATTEMPTS = 1
+BOTO_POOL_CONNECTIONS = 10
+# boto3's default session is not thread-safe while creating clients
+CLIENT_LOCK = threading.Lock()
+# clients live at module level so that warm Lambda invocations reuse them
+CLIENT_POOL = {}
+# optional callable(service, region) returning a client, e.g. an offline fake
+CLIENT_FACTORY = None
+
+
+def get_client(service, region, max_pool_connections=BOTO_POOL_CONNECTIONS):
+    '''
+    Return a pooled boto client for the service in the given region, making BOTO_MAX_ATTEMPTS
+    attempts per call over max_pool_connections HTTP connections, enough for as many threads
+    as share the client.
+    boto3 is imported on first use, keeping it out of module import time
+    '''
+    key = (service, region, max_pool_connections)
+    with CLIENT_LOCK:
+        if key not in CLIENT_POOL:
+            if CLIENT_FACTORY:
+                CLIENT_POOL[key] = CLIENT_FACTORY(service, region)
+            else:
+                import boto3  # pylint: disable=import-outside-toplevel
+                from botocore.config import Config  # pylint: disable=import-outside-toplevel
+                config = Config(retries={'mode': 'standard',
+                                         'total_max_attempts': BOTO_MAX_ATTEMPTS},
+                                max_pool_connections=max_pool_connections)
+                CLIENT_POOL[key] = boto3.client(service, region_name=region, config=config)
+        return CLIENT_POOL[key]
+
+
+def set_client_factory(factory):
+    '''
+    Build clients with factory(service, region) instead of boto3; None restores boto3.
+    Pooled clients are discarded so that no client from the previous factory is reused
+    '''
+    global CLIENT_FACTORY  # pylint: disable=global-statement
+    with CLIENT_LOCK:
+        CLIENT_FACTORY = factory
+        CLIENT_POOL.clear()
@@ -3,22 +3,38 @@ Helper function to retrieve AWS Secrets
 """
 import base64
 import json
-import boto3
+import threading
+import time
 from botocore.exceptions import ClientError
 
+import aws_client_utils as aws_client
+import metrics_utils as metrics
+
+SECRET_TTL_SECONDS = 900
+# secrets live at module level so that warm Lambda invocations skip Secrets Manager
+SECRET_CACHE = {}
+SECRET_LOCK = threading.Lock()
+
 class SecretsClient():
     '''
     Class to interact with AWS Secrets Manager
     '''
-    def __init__(self, region):
-        self.secrets_client = boto3.client(service_name='secretsmanager',
-                                           region_name=region)
+    def __init__(self, region, ttl=SECRET_TTL_SECONDS):
+        self.region = region
+        self.ttl = ttl
+        self.secrets_client = metrics.instrument(aws_client.get_client('secretsmanager', region),
+                                                 'SecretsManager', region)
 
 
     def get_aws_secret(self, secret_name):
         '''
-        Wraps process of retrieve and decoding secret
+        Wraps process of retrieve and decoding secret, served from cache for up to ttl seconds
         '''
+        key = (self.region, secret_name)
+        with SECRET_LOCK:
+            cached = SECRET_CACHE.get(key)
+        if cached and cached[0] > time.time():
+            return cached[1]
         secret = None
         try:
             secret_value = self.secrets_client.get_secret_value(
@@ -39,6 +55,8 @@ class SecretsClient():
                 secret = secret_value['SecretString']
             else:
                 secret = base64.b64decode(secret_value['SecretBinary'])
+            with SECRET_LOCK:
+                SECRET_CACHE[key] = (time.time() + self.ttl, secret)
         return secret
 
     def get_aws_secret_value(self, secret_name, key):
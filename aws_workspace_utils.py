@@ -2,31 +2,199 @@
 Helper function for all things workspaces
 """
 
-import boto3
+import collections
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError
+
+import aws_client_utils as aws_client
+import common_utils as utils
+import metrics_utils as metrics
+
+BACKOFF_BASE_SECONDS = 0.2
+BACKOFF_CAP_SECONDS = 10
+CREATE_RETRIES = 1
+DELETE_WORKERS = 4
+MAX_CREATE_BATCH = 25
+MAX_BACKOFF_ATTEMPTS = 6
+MIGRATION_WORKERS = 4
+TAG_WORKERS = 8
+# default HTTP connections per client, one for each worker of the widest concurrent call
+POOL_CONNECTIONS = max(DELETE_WORKERS, MIGRATION_WORKERS, TAG_WORKERS)
+THROTTLE_ERRORS = {'ThrottlingException', 'RequestLimitExceeded', 'TooManyRequestsException'}
+# FailedRequests error codes worth resubmitting; others (ResourceExists.WorkSpace, ...) are final
+CREATE_RETRY_ERRORS = THROTTLE_ERRORS | {'ResourceLimitExceeded', 'ResourceUnavailable',
+                                         'InternalError'}
+# operations throttled apart from the others with their verb, e.g. the per-workspace DescribeTags
+OPERATION_CLASSES = {'describe_tags': 'tags'}
+# one adaptive limiter per (region, operation class), shared by every client and thread
+RATE_LIMITERS = {}
+RATE_LIMITERS_LOCK = threading.Lock()
+
+
+class Record():
+    '''
+    Base of the compact inventory records: a namedtuple of the few boto response fields
+    the planners read, which also answers the dict-style get() they use
+    '''
+    __slots__ = ()
+
+    def get(self, key, default=None):
+        '''
+        Return the named field, or default if the record does not keep it
+        '''
+        return getattr(self, key) if key in self._fields else default
+
+    @classmethod
+    def from_boto(cls, item):
+        '''
+        Build a record from one entry of a describe_* response
+        '''
+        return cls._make(item.get(field) for field in cls._fields)
+
+
+class Bundle(Record, collections.namedtuple('Bundle', ['BundleId', 'Name', 'ImageId'])):
+    '''
+    A DescribeWorkspaceBundles entry
+    '''
+    __slots__ = ()
+
+
+class Directory(Record, collections.namedtuple('Directory', ['DirectoryId', 'Alias', 'State'])):
+    '''
+    A DescribeWorkspaceDirectories entry
+    '''
+    __slots__ = ()
+
+
+class Image(Record, collections.namedtuple('Image', ['ImageId', 'Name', 'State'])):
+    '''
+    A DescribeWorkspaceImages entry
+    '''
+    __slots__ = ()
+
+
+class Workspace(Record, collections.namedtuple('Workspace', ['WorkspaceId', 'DirectoryId',
+                                                             'UserName', 'BundleId', 'State'])):
+    '''
+    A DescribeWorkspaces entry
+    '''
+    __slots__ = ()
+
+
+def call_with_backoff(func, rate_limiter=None, **kwargs):
+    '''
+    Call a boto client function, retrying with jittered exponential backoff while throttled
+    or while WorkSpaces answers with a server error. Boto clients make a single attempt
+    (see aws_client_utils), so this loop owns retries.
+    An AdaptiveRateLimiter paces every attempt and learns from its outcome
+    '''
+    attempt = 0
+    while True:
+        if rate_limiter:
+            rate_limiter.acquire()
+        try:
+            response = func(**kwargs)
+        except ClientError as err:
+            attempt += 1
+            throttled = err.response['Error']['Code'] in THROTTLE_ERRORS
+            server_error = err.response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0) >= 500
+            if throttled and rate_limiter:
+                rate_limiter.on_throttle()
+            if not (throttled or server_error) or attempt >= MAX_BACKOFF_ATTEMPTS:
+                raise err
+            delay = min(BACKOFF_CAP_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt)
+            metrics.record_retry(func)
+            time.sleep(random.uniform(0, delay))
+        else:
+            if rate_limiter:
+                rate_limiter.on_success()
+            return response
+
+
+def get_rate_limiter(region, operation):
+    '''
+    Return the shared limiter for the class of a boto operation in a region: describe_tags,
+    which is called once per workspace, or else the operation's verb (describe, create, migrate,
+    delete). The paginated describe_* listings share one limiter, so a throttled listing also
+    slows the other listings of its region
+    '''
+    key = (region, OPERATION_CLASSES.get(operation, operation.split('_')[0]))
+    with RATE_LIMITERS_LOCK:
+        if key not in RATE_LIMITERS:
+            RATE_LIMITERS[key] = utils.AdaptiveRateLimiter()
+        return RATE_LIMITERS[key]
+
 
 class WorkSpaceClient():
     '''
     A class that abstracts AWS Workspace boto client
     '''
-    def __init__(self, region):
+    def __init__(self, region, client_factory=None, pool_connections=POOL_CONNECTIONS):
         '''
-        Create a client to interact with WorkSpaces in a region
+        Create a client to interact with WorkSpaces in a region, over pool_connections HTTP
+        connections: at least as many as the workers of any concurrent call made with it.
+        client_factory(service, region) overrides the pooled boto client, e.g. with a fake
         '''
-        self.ws_client = boto3.client('workspaces', region_name=region)
+        self.region = region
+        if client_factory:
+            ws_client = client_factory('workspaces', region)
+        else:
+            ws_client = aws_client.get_client('workspaces', region, pool_connections)
+        self.ws_client = metrics.instrument(ws_client, 'WorkSpaces', region)
+
+    def call(self, operation, **kwargs):
+        '''
+        Call a boto operation paced by the region's shared limiter, backing off while throttled
+        '''
+        return call_with_backoff(getattr(self.ws_client, operation),
+                                 get_rate_limiter(self.region, operation), **kwargs)
 
     def create_workspace(self, workspace_config):
         '''
         Create a WorkSpace in the given region
         '''
-        response = self.ws_client.create_workspaces(Workspaces=[workspace_config])
+        response = self.call('create_workspaces', Workspaces=[workspace_config])
 
         return response
 
+    def create_workspaces(self, workspace_configs, retries=CREATE_RETRIES):
+        '''
+        Create WorkSpaces in batches of up to MAX_CREATE_BATCH, resubmitting only requests that
+        failed with a transient error (CREATE_RETRY_ERRORS).
+        Returns the PendingRequests and the FailedRequests left after the last attempt.
+        '''
+        pending = []
+        failed = []
+        remaining = list(workspace_configs)
+        for attempt in range(retries + 1):
+            if attempt:
+                time.sleep(random.uniform(0, BACKOFF_BASE_SECONDS * 2 ** attempt))
+            retry = []
+            for start in range(0, len(remaining), MAX_CREATE_BATCH):
+                response = self.call('create_workspaces',
+                                     Workspaces=remaining[start:start + MAX_CREATE_BATCH])
+                pending.extend(response.get('PendingRequests', []))
+                for request in response.get('FailedRequests', []):
+                    code = (request.get('ErrorCode') or '').split('.')[0]
+                    if code in CREATE_RETRY_ERRORS and attempt < retries:
+                        retry.append(request)
+                    else:
+                        failed.append(request)
+            if not retry:
+                break
+            remaining = [i.get('WorkspaceRequest') for i in retry]
+
+        return pending, failed
+
     def delete_bundle(self, bundle_id):
         '''
         Delete a Bundle in the given region
         '''
-        response = self.ws_client.delete_workspace_bundle(BundleId=bundle_id)
+        response = self.call('delete_workspace_bundle', BundleId=bundle_id)
 
         return response
 
@@ -34,47 +202,83 @@ class WorkSpaceClient():
         '''
         Delete an Image in the given region
         '''
-        response = self.ws_client.delete_workspace_image(ImageId=image_id)
+        response = self.call('delete_workspace_image', ImageId=image_id)
 
         return response
 
+    def delete_bundles_and_images(self, bundle_ids, image_ids, image_bundles,
+                                  max_workers=DELETE_WORKERS):
+        '''
+        Delete bundles and then images concurrently, backing off while throttled.
+        An image is only deleted once every bundle listed for it in image_bundles
+        ({image_id: [bundle ids]}) has been deleted successfully.
+        Returns {resource id: {'Type', 'Success', 'Error'}}
+        '''
+        def delete(resource_type, resource_id):
+            if resource_type == 'bundle':
+                operation, kwargs = 'delete_workspace_bundle', {'BundleId': resource_id}
+            else:
+                operation, kwargs = 'delete_workspace_image', {'ImageId': resource_id}
+            try:
+                self.call(operation, **kwargs)
+            except ClientError as err:
+                return {'Type': resource_type, 'Success': False,
+                        'Error': err.response['Error'].get('Code')}
+            return {'Type': resource_type, 'Success': True, 'Error': None}
+
+        report = {}
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            report.update(zip(bundle_ids,
+                              executor.map(lambda i: delete('bundle', i), bundle_ids)))
+            ready = []
+            for image_id in image_ids:
+                if all(report.get(i, {}).get('Success') for i in image_bundles.get(image_id, [])):
+                    ready.append(image_id)
+                else:
+                    report[image_id] = {'Type': 'image', 'Success': False,
+                                        'Error': 'BundleDeleteFailed'}
+            report.update(zip(ready, executor.map(lambda i: delete('image', i), ready)))
+
+        return report
+
     def get_current_bundles(self):
         '''
-        Retrieve all bundles in the current region, used for deriving config
+        Retrieve all bundles in the current region as {Name: Bundle}, used for deriving config
         '''
-        bundles = None
-        response = self.ws_client.describe_workspace_bundles()
-        bundles = {i['Name']:i for i in response['Bundles']}
+        bundles = {}
+        for page in self.iter_bundle_pages():
+            bundles.update({i['Name']:Bundle.from_boto(i) for i in page})
 
         return bundles
 
     def get_current_directories(self):
         '''
-        Retrieve all directories in the current region, used for deriving config
+        Retrieve all directories in the current region as {Alias: Directory}, used for deriving config
         '''
-        directories = None
-        response = self.ws_client.describe_workspace_directories()
-        directories = {i['Alias']:i for i in response['Directories']}
+        directories = {}
+        for page in self.iter_directory_pages():
+            directories.update({i['Alias']:Directory.from_boto(i) for i in page})
 
         return directories
 
     def get_current_images(self):
         '''
-        Retrieve all images in the current region, used for deriving config
+        Retrieve all images in the current region as {Name: Image}, used for deriving config
         '''
-        images = None
-        response = self.ws_client.describe_workspace_images()
-        images = {i['Name']:i for i in response['Images']}
+        images = {}
+        for page in self.iter_image_pages():
+            images.update({i['Name']:Image.from_boto(i) for i in page})
 
         return images
 
-    def get_current_workspaces(self):
+    def get_current_workspaces(self, directory_ids=None):
         '''
-        Retrieve all workspaces in the current region, used for creating the list for creation
+        Retrieve all workspaces in the current region as Workspace records, used for creating
+        the list for creation. With directory_ids, only the workspaces in those directories are listed
         '''
-        workspaces = None
-        response = self.ws_client.describe_workspaces()
-        workspaces = response['Workspaces']
+        workspaces = []
+        for page in self.iter_workspace_pages(directory_ids):
+            workspaces.extend(Workspace.from_boto(i) for i in page)
 
         return workspaces
 
@@ -83,17 +287,104 @@ class WorkSpaceClient():
         Given a ResourceId, retrieve the tags associated with it, used for determining ownership
         '''
         tags = None
-        response = self.ws_client.describe_tags(ResourceId=resource_id)
+        response = self.call('describe_tags', ResourceId=resource_id)
         tags = response.get('TagList')
 
         return tags
 
+    def get_tags_bulk(self, resource_ids, max_workers=TAG_WORKERS):
+        '''
+        Retrieve tags for many ResourceIds concurrently, returned as {ResourceId: tags}.
+        A resource whose tags cannot be read (e.g. terminated since it was listed) maps to None
+        '''
+        def get_tags(resource_id):
+            try:
+                return self.get_tags(resource_id)
+            except ClientError as err:
+                print('WARNING: Could not read tags for {}: {}'.format(
+                    resource_id, err.response['Error'].get('Code')))
+                return None
+
+        resource_ids = list(resource_ids)
+        if not resource_ids:
+            return {}
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            tag_lists = executor.map(get_tags, resource_ids)
+            tag_map = dict(zip(resource_ids, tag_lists))
+
+        return tag_map
+
+    def iter_bundle_pages(self):
+        '''
+        Lazily yield pages of bundles in the current region
+        '''
+        return self.iter_pages('describe_workspace_bundles', 'Bundles')
+
+    def iter_directory_pages(self):
+        '''
+        Lazily yield pages of directories in the current region
+        '''
+        return self.iter_pages('describe_workspace_directories', 'Directories')
+
+    def iter_image_pages(self):
+        '''
+        Lazily yield pages of images in the current region
+        '''
+        return self.iter_pages('describe_workspace_images', 'Images')
+
+    def iter_pages(self, operation, result_key, **kwargs):
+        '''
+        Call a describe_* operation, following NextToken, and yield the result list of each page.
+        Only one page is held in memory at a time. Pages are paced and retried like every call.
+        '''
+        while True:
+            response = self.call(operation, **kwargs)
+            yield response.get(result_key, [])
+            next_token = response.get('NextToken')
+            if not next_token:
+                break
+            kwargs['NextToken'] = next_token
+
+    def iter_workspace_pages(self, directory_ids=None):
+        '''
+        Lazily yield pages of workspaces in the current region.
+        With directory_ids, DescribeWorkspaces filters by each DirectoryId server side
+        '''
+        if directory_ids is None:
+            yield from self.iter_pages('describe_workspaces', 'Workspaces')
+            return
+        for directory_id in directory_ids:
+            yield from self.iter_pages('describe_workspaces', 'Workspaces',
+                                       DirectoryId=directory_id)
+
     def migrate_workspace(self, workspace_id, bundle_id):
         '''
         Migrate a WorkSpace in the given region to the given bundle_id.
         See https://docs.aws.amazon.com/workspaces/latest/adminguide/migrate-workspaces.html
         '''
-        response = self.ws_client.migrate_workspace(SourceWorkspaceId=workspace_id,
-                                                    BundleId=bundle_id)
+        response = self.call('migrate_workspace', SourceWorkspaceId=workspace_id,
+                             BundleId=bundle_id)
 
         return response
+
+    def migrate_workspaces(self, migrations, max_workers=MIGRATION_WORKERS, rate_limiter=None):
+        '''
+        Migrate many (workspace_id, bundle_id) pairs concurrently, paced by an optional
+        rate_limiter and backing off while throttled.
+        Returns {workspace_id: {'Success', 'Error'}}
+        '''
+        def migrate(migration):
+            if rate_limiter:
+                rate_limiter.acquire()
+            try:
+                self.call('migrate_workspace',
+                          SourceWorkspaceId=migration[0], BundleId=migration[1])
+            except ClientError as err:
+                return {'Success': False, 'Error': err.response['Error'].get('Code')}
+            return {'Success': True, 'Error': None}
+
+        migrations = list(migrations)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            report = dict(zip([i[0] for i in migrations], executor.map(migrate, migrations)))
+
+        return report
@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+"""
+Benchmark suite for the plan-computation hot paths of the three lambda functions
+Times each path (best of --repeats) and records its tracemalloc peak at increasing fleet
+and bundle-catalog sizes, using fleets seeded by fake_workspaces. Results are written to
+--output and compared with a stored baseline; the run exits non-zero if any path is slower
+or uses more memory than the baseline allows. Timings are machine specific: regenerate the
+baseline with --update-baseline when moving to a new machine or after an intended change.
+
+   Usage: python benchmarks/bench_plan.py [--sizes 1000,5000,20000] [--update-baseline]
+
+   Copyright 2021 Zulily, Inc.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+     http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+# add parent directory to path
+sys.path.insert(1, os.path.join(sys.path[0], '..'))
+import aws_workspace_utils as aws_ws
+import common_utils as utils
+import fake_workspaces
+import workspacecleanup
+import workspacer
+import workspacerefresh
+
+BASE_DIR = os.path.dirname(os.path.realpath(__file__))
+BASELINE_FILE = os.path.join(BASE_DIR, 'baseline.json')
+REGION = 'us-east-1'
+# differences below these are treated as noise, whatever the ratio
+NOISE_FLOOR = {'seconds': 0.002, 'peak_bytes': 64 * 1024}
+# bundle catalog size is driven by the number of patch dates kept
+CATALOG_PATCHES = [3, 30, 300]
+CONFIG = {'team_workspaces': {team: {'Tags': [{'Key': 'team', 'Value': team}]}
+                              for team in fake_workspaces.DEFAULT_TEAMS},
+          'directory_suffixes': fake_workspaces.DEFAULT_SUFFIXES,
+          'directory_suffixes_non_encrypted': [],
+          'supported_prefix': fake_workspaces.DEFAULT_PREFIX}
+
+
+def patch_dates(count):
+    '''
+    Return count distinct YYYYMMDD patch dates
+    '''
+    return ['2021{:02d}{:02d}'.format(1 + i // 28 % 12, 1 + i % 28) if i < 336 else
+            '{}0101'.format(2022 + i) for i in range(count)]
+
+
+def seeded_region(workspaces, patches=3):
+    '''
+    Seed a fake region and return it with a WorkSpaceClient reading from it
+    '''
+    backend = fake_workspaces.FakeWorkSpacesBackend(seed=1)
+    backend.region(REGION).seed_fleet(workspaces=workspaces, patch_dates=patch_dates(patches))
+    client = aws_ws.WorkSpaceClient(REGION, client_factory=backend.client_factory)
+    return client
+
+
+def build_cases(sizes):
+    '''
+    Return {case name: callable} for every hot path at every size
+    '''
+    cases = {}
+    for size in sizes:
+        client = seeded_region(size)
+        bundles = client.get_current_bundles()
+        existing_dirs = client.get_current_directories()
+        existing_ws = client.get_current_workspaces()
+        images = client.get_current_images()
+        # every existing user is requested again, plus 10% new users
+        ws_list = [{'UserName': 'new{:06d}'.format(i) if i >= len(existing_ws) else
+                                existing_ws[i].UserName,
+                    'Directory': fake_workspaces.DEFAULT_SUFFIXES[i % 3],
+                    'Region': REGION,
+                    'Team': fake_workspaces.DEFAULT_TEAMS[i % 3]}
+                   for i in range(int(len(existing_ws) * 1.1))]
+        aliases_map = workspacer.get_directory_id_map(REGION, CONFIG['directory_suffixes'],
+                                                      existing_dirs)
+        managed_ws = client.get_current_workspaces(
+            utils.get_directory_ids(REGION, CONFIG['directory_suffixes'], existing_dirs))
+        tag_map = client.get_tags_bulk([i.WorkspaceId for i in managed_ws])
+        bundle_map = workspacerefresh.get_latest_bundle_map(bundles, CONFIG['team_workspaces'])
+        total_map = workspacecleanup.get_latest_total_bundle_map(bundles, CONFIG['team_workspaces'])
+
+        def exists_all(ws_list=ws_list, existing_ws=existing_ws, aliases_map=aliases_map):
+            index = workspacer.build_workspace_index(existing_ws)
+            for ws_instance in ws_list:
+                ws_alias = '{}-{}'.format(REGION, ws_instance['Directory'])
+                workspacer.check_workspace_exists(ws_instance, ws_alias, index, aliases_map)
+
+        cases['determine_new_workspaces@{}'.format(size)] = \
+            lambda b=bundles, d=existing_dirs, e=existing_ws, w=ws_list: \
+            workspacer.determine_new_workspaces(CONFIG, b, d, e, REGION, w)
+        cases['check_workspace_exists@{}'.format(size)] = exists_all
+        cases['get_ws_updates@{}'.format(size)] = \
+            lambda t=tag_map, m=managed_ws, b=bundle_map: workspacerefresh.get_ws_updates(t, m, b)
+        cases['get_deletes@{}'.format(size)] = \
+            lambda e=existing_ws, b=bundles, i=images, t=total_map: \
+            workspacecleanup.get_deletes(e, b, i, t, CONFIG['supported_prefix'])
+    for patches in CATALOG_PATCHES:
+        client = seeded_region(sizes[0], patches)
+        bundles = client.get_current_bundles()
+        existing_ws = client.get_current_workspaces()
+        images = client.get_current_images()
+        total_map = workspacecleanup.get_latest_total_bundle_map(bundles, CONFIG['team_workspaces'])
+        cases['determine_team_bundle_id@{}bundles'.format(len(bundles))] = \
+            lambda b=bundles: [utils.determine_team_bundle_id(b, team)
+                               for team in CONFIG['team_workspaces']]
+        cases['get_deletes@{}x{}bundles'.format(sizes[0], len(bundles))] = \
+            lambda e=existing_ws, b=bundles, i=images, t=total_map: \
+            workspacecleanup.get_deletes(e, b, i, t, CONFIG['supported_prefix'])
+    return cases
+
+
+def measure(func, repeats):
+    '''
+    Return (best wall seconds, tracemalloc peak bytes) for func, with its logging silenced
+    '''
+    best = None
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeats):
+            start = time.perf_counter()
+            func()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        tracemalloc.start()
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return best, peak
+
+
+def compare(results, baseline, threshold):
+    '''
+    Return the cases whose time or peak memory exceeds the baseline by more than threshold
+    '''
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        for metric in ('seconds', 'peak_bytes'):
+            if result[metric] > base[metric] * (1 + threshold) and \
+               result[metric] - base[metric] > NOISE_FLOOR[metric]:
+                regressions.append('{} {}: {:.4g} > baseline {:.4g}'.format(
+                    name, metric, result[metric], base[metric]))
+    return regressions
+
+
+def main():
+    '''
+    Run the suite, write the results artifact, and compare against the baseline
+    '''
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--sizes', default='1000,5000,20000',
+                        help='comma separated fleet sizes')
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--threshold', type=float, default=1.0,
+                        help='allowed fractional regression over the baseline')
+    parser.add_argument('--baseline', default=BASELINE_FILE)
+    parser.add_argument('--output', default='bench_output.txt')
+    parser.add_argument('--update-baseline', action='store_true')
+    args = parser.parse_args()
+
+    results = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        cases = build_cases([int(i) for i in args.sizes.split(',')])
+    for name, func in cases.items():
+        seconds, peak = measure(func, args.repeats)
+        results[name] = {'seconds': seconds, 'peak_bytes': peak}
+        print('{:<45} {:>10.4f}s {:>12,d} bytes peak'.format(name, seconds, peak))
+    with open(args.output, 'w') as output:
+        json.dump(results, output, indent=2, sort_keys=True)
+
+    if args.update_baseline:
+        with open(args.baseline, 'w') as baseline:
+            json.dump(results, baseline, indent=2, sort_keys=True)
+        print('Baseline written to {}'.format(args.baseline))
+        return 0
+    baseline = utils.load_state_json(args.baseline)
+    regressions = compare(results, baseline, args.threshold)
+    for regression in regressions:
+        print('REGRESSION: {}'.format(regression))
+    print('{} cases, {} regressions against {}'.format(len(results), len(regressions),
+                                                       args.baseline))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
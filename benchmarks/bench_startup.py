@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+"""
+Startup benchmark for the lambda handlers
+Reports, for each handler, the module import time, the time to the first boto client
+(which is when boto3 is now imported) and the size of its deployment package.
+Build the packages first (optionally with LEAN_BUILD=1) to measure the artifacts themselves.
+
+   Usage: python benchmarks/bench_startup.py [repeats]
+
+   Copyright 2021 Zulily, Inc.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+     http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import os
+import subprocess
+import sys
+
+BASE_DIR = os.path.realpath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+HANDLERS = {'maker': 'workspacer',
+            'refresh': 'workspacerefresh',
+            'cleanup': 'workspacecleanup'}
+TIMER = '''
+import time
+start = time.perf_counter()
+import {module}
+imported = time.perf_counter()
+import aws_client_utils
+aws_client_utils.get_client('workspaces', 'us-east-1')
+print(imported - start, time.perf_counter() - start)
+'''
+
+
+def directory_size(path):
+    '''
+    Total size in bytes of every file under path
+    '''
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+    return total
+
+
+def time_startup(module, cwd, repeats):
+    '''
+    Median import and first-client times over fresh interpreters, in milliseconds
+    '''
+    samples = []
+    for _ in range(repeats):
+        output = subprocess.run([sys.executable, '-c', TIMER.format(module=module)],
+                                cwd=cwd, check=True, capture_output=True, text=True,
+                                env=dict(os.environ, PYTHONDONTWRITEBYTECODE='1'))
+        samples.append([float(i) * 1000 for i in output.stdout.split()])
+    samples.sort()
+    return samples[len(samples) // 2]
+
+
+def run(repeats):
+    '''
+    Print the startup report for every handler
+    '''
+    print('{:<8} {:>10} {:>15} {:>12} {:>12}'.format('handler', 'import ms', 'first client ms',
+                                                   'dist KiB', 'zip KiB'))
+    for name, module in HANDLERS.items():
+        dist = os.path.join(BASE_DIR, 'dist_{}'.format(name))
+        archive = os.path.join(BASE_DIR, 'aws_workspace_{}.zip'.format(name))
+        cwd = dist if os.path.isdir(dist) else BASE_DIR
+        import_ms, client_ms = time_startup(module, cwd, repeats)
+        dist_size = '{:.0f}'.format(directory_size(dist) / 1024) if os.path.isdir(dist) else 'n/a'
+        zip_size = '{:.0f}'.format(os.path.getsize(archive) / 1024) \
+            if os.path.exists(archive) else 'n/a'
+        print('{:<8} {:>10.1f} {:>15.1f} {:>12} {:>12}'.format(name, import_ms, client_ms,
+                                                              dist_size, zip_size))
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+"""
+Micro-benchmark for the workspace existence check used by determine_new_workspaces
+Compares the previous linear scan of existing workspaces with the (UserName, DirectoryId) index.
+
+   Usage: python benchmarks/bench_workspace_index.py [users] [workspaces]
+
+   Copyright 2021 Zulily, Inc.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+     http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import os
+import sys
+import time
+
+# add parent directory to path
+sys.path.insert(1, os.path.join(sys.path[0], '..'))
+import workspacer
+
+REGION = 'us-east-1'
+SUFFIXES = ['production', 'admin', 'test']
+# the linear scan is timed on a sample of requests and extrapolated
+LINEAR_SAMPLE = 500
+
+
+def linear_exists(ws_instance, ws_alias, existing_ws_list, directory_ids):
+    '''
+    The previous implementation: scan every existing workspace for each request
+    '''
+    exists = False
+    for workspace in existing_ws_list:
+        if ws_instance.get('UserName') == workspace.get('UserName') and \
+           directory_ids[ws_alias] == workspace.get('DirectoryId'):
+            exists = True
+
+    return exists
+
+
+def synthetic_fleet(users, workspaces):
+    '''
+    Build a requested user list and an existing fleet provisioned for the first `workspaces` users
+    '''
+    directory_ids = {'{}-{}'.format(REGION, suffix): 'd-{}'.format(index)
+                     for index, suffix in enumerate(SUFFIXES)}
+    ws_list = [{'UserName': 'user{}'.format(i),
+                'Directory': SUFFIXES[i % len(SUFFIXES)],
+                'Region': REGION,
+                'Team': 'team{}'.format(i % 7)} for i in range(users)]
+    existing_ws = [{'UserName': i['UserName'],
+                    'DirectoryId': directory_ids['{}-{}'.format(REGION, i['Directory'])],
+                    'WorkspaceId': 'ws-{}'.format(n)} for n, i in enumerate(ws_list[:workspaces])]
+
+    return ws_list, existing_ws, directory_ids
+
+
+def run(users, workspaces):
+    '''
+    Time both existence checks over every request and print the speedup
+    '''
+    ws_list, existing_ws, directory_ids = synthetic_fleet(users, workspaces)
+    aliases = ['{}-{}'.format(i['Region'], i['Directory']) for i in ws_list]
+
+    sample = list(zip(ws_list, aliases))[:LINEAR_SAMPLE]
+    start = time.perf_counter()
+    for ws_instance, ws_alias in sample:
+        linear_exists(ws_instance, ws_alias, existing_ws, directory_ids)
+    linear = (time.perf_counter() - start) * users / len(sample)
+
+    start = time.perf_counter()
+    index = workspacer.build_workspace_index(existing_ws)
+    found = 0
+    for ws_instance, ws_alias in zip(ws_list, aliases):
+        found += workspacer.check_workspace_exists(ws_instance, ws_alias, index, directory_ids)
+    indexed = time.perf_counter() - start
+
+    print('users={} workspaces={} existing_found={}'.format(users, workspaces, found))
+    print('linear scan (extrapolated from {} requests): {:.3f}s'.format(len(sample), linear))
+    print('indexed (including index build): {:.3f}s'.format(indexed))
+    print('speedup: {:.0f}x'.format(linear / indexed))
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 50000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 45000)
@@ -17,50 +17,253 @@
    limitations under the License.
 """
 
+import copy
 import json
+import os
 import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# AdaptiveRateLimiter: floor in calls per second, additive increase per second, multiplicative cut
+ADAPTIVE_DECREASE = 0.5
+ADAPTIVE_INCREASE = 1.0
+ADAPTIVE_MIN_RATE = 0.5
+# shortest span, in seconds, the send rate is measured over
+ADAPTIVE_MIN_WINDOW = 0.1
+BUNDLE_NAME_PATTERN = re.compile(r"^.*?_(\d+)_?(\w*)?$")
+REGION_CONCURRENCY = 4
+# parsed config files live at module level so that warm Lambda invocations skip re-reading them
+CONFIG_CACHE = {}
+
+
+class BundleIndex():
+    '''
+    Parses bundle names (<prefix>_<patch date>[_<team>]) once into the latest default
+    and per-team bundles, so that latest-bundle lookups are constant time
+    '''
+    def __init__(self, bundles):
+        '''
+        Index the given {Name: bundle} map
+        '''
+        self.bundles = bundles
+        self.default_name = None
+        self.team_names = {}
+        latest_default = 0
+        latest_patches = {}
+        for name in bundles.keys():
+            match = BUNDLE_NAME_PATTERN.match(name)
+            if not match:
+                print("Info: Ignoring bundle {} with no patch date".format(name))
+                continue
+            patch_date = int(match.group(1))
+            bundle_team = match.group(2)
+            if not bundle_team:
+                if patch_date > latest_default:
+                    latest_default = patch_date
+                    self.default_name = name
+            elif patch_date > latest_patches.get(bundle_team, 0):
+                latest_patches[bundle_team] = patch_date
+                self.team_names[bundle_team] = name
+
+    def latest_bundle_id(self, team):
+        '''
+        Get latest bundle for the given team, falling back to the latest default bundle
+        '''
+        latest_bundle_id = None
+        name = self.team_names.get(team, self.default_name)
+        if name:
+            latest_bundle_id = self.bundles[name].get('BundleId')
+        else:
+            print("Error: No patch found for team {}".format(team))
+
+        return latest_bundle_id
+
+
+class RateLimiter():
+    '''
+    Thread-safe token bucket allowing `rate` acquisitions per second, in bursts of up to `burst`.
+    A rate of None or 0 never waits
+    '''
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        '''
+        Block until a token is available, then take it
+        '''
+        if not self.rate:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class AdaptiveRateLimiter(RateLimiter):
+    '''
+    RateLimiter adjusting its rate AIMD-style: unlimited until the first throttle, which sets it
+    to `decrease` times the rate calls were being sent at; it then grows by `increase` per second
+    of successes and is cut again, at most once per second, on each further throttle
+    '''
+    def __init__(self, min_rate=ADAPTIVE_MIN_RATE, increase=ADAPTIVE_INCREASE,
+                 decrease=ADAPTIVE_DECREASE):
+        super().__init__(None)
+        self.min_rate = min_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.window_start = time.monotonic()
+        self.window_sends = 0
+        self.send_rate = 0
+        self.increased_at = 0
+        self.decreased_at = 0
+
+    def acquire(self):
+        '''
+        Count the call towards the measured send rate, then wait for a token
+        '''
+        with self.lock:
+            now = time.monotonic()
+            self.window_sends += 1
+            if now - self.window_start >= 1:
+                self.send_rate = self.window_sends / (now - self.window_start)
+                self.window_start = now
+                self.window_sends = 0
+        super().acquire()
+
+    def on_success(self):
+        '''
+        Raise the rate by `increase` for every second since it was last raised or cut
+        '''
+        with self.lock:
+            now = time.monotonic()
+            if self.rate and now - self.increased_at >= 1:
+                self.rate += self.increase * (now - self.increased_at)
+                self.increased_at = now
+
+    def on_throttle(self):
+        '''
+        Cut the rate after a throttled call; concurrent throttles within a second cut it once
+        '''
+        with self.lock:
+            now = time.monotonic()
+            if self.rate and now - self.decreased_at < 1:
+                return
+            current = self.rate or max(self.send_rate, self.window_sends /
+                                       max(now - self.window_start, ADAPTIVE_MIN_WINDOW))
+            self.rate = max(self.min_rate, current * self.decrease)
+            self.tokens = min(self.tokens, 1)
+            self.updated = now
+            self.increased_at = now
+            self.decreased_at = now
 
 
 def determine_team_bundle_id(bundles, team):
     '''
     Get latest bundle for the given team
+    Build a BundleIndex directly when looking up more than one team
     '''
-    latest_default = 0
-    latest_patch = 0
-    default_name = None
-    patch_name = None
-    latest_bundle_id = None
-    names = bundles.keys()
-    for name in names:
-        # get team bundles
-        match = re.match(r"^.*?_(\d+)_?(\w*)?$", name)
-        patch_date = match.group(1)
-        bundle_team = match.group(2)
-        if not bundle_team and int(patch_date) > latest_default:
-            latest_default = int(patch_date)
-            default_name = name
-        elif bundle_team == team and int(patch_date) > latest_patch:
-            latest_patch = int(patch_date)
-            patch_name = name
-    if patch_name:
-        latest_bundle_id = bundles[patch_name].get('BundleId')
-    elif default_name:
-        latest_bundle_id = bundles[default_name].get('BundleId')
-    else:
-        print("Error: No patch found for team {}".format(team))
-
-    return latest_bundle_id
+    return BundleIndex(bundles).latest_bundle_id(team)
+
+
+def get_directory_ids(region, suffixes, existing_dirs):
+    '''
+    Return the list of directory ids managed by workspace_maker in a region
+    '''
+    ids = []
+    for suffix in suffixes:
+        alias = '{}-{}'.format(region, suffix)
+        if alias in existing_dirs:
+            ids.append(existing_dirs[alias].get('DirectoryId'))
+
+    return ids
 
 
 def load_config_json(file_name):
     '''
-    Load JSON configuration
+    Load JSON configuration, reusing the parsed copy while the file is unmodified
     '''
     mydict = None
+    stat = os.stat(file_name)
+    version = (stat.st_mtime_ns, stat.st_size)
+    cached = CONFIG_CACHE.get(file_name)
+    if cached and cached[0] == version:
+        return copy.deepcopy(cached[1])
     try:
         with open(file_name, 'r') as deffile:
             mydict = json.load(deffile)
+        CONFIG_CACHE[file_name] = (version, mydict)
+        mydict = copy.deepcopy(mydict)
     except ValueError as error:
         print('Failed to load file: %s', file_name)
         print('Critical: %s', str(error))
     return mydict
+
+
+def load_state_json(file_name):
+    '''
+    Load JSON state persisted between runs, returning an empty dict if there is none
+    '''
+    state = {}
+    try:
+        with open(file_name, 'r') as statefile:
+            state = json.load(statefile)
+    except FileNotFoundError:
+        pass
+    except ValueError as error:
+        print('Warning: Ignoring unreadable state file {}: {}'.format(file_name, error))
+    return state
+
+
+def print_region_summary(summary):
+    '''
+    Print one line per region from a run_regions summary
+    '''
+    for region in sorted(summary):
+        details = ', '.join('{}={}'.format(key, value) for key, value in summary[region].items())
+        print('Summary: region {}: {}'.format(region, details))
+
+
+def run_regions(regions, region_func, max_workers=REGION_CONCURRENCY):
+    '''
+    Run region_func(region) for each region on a bounded thread pool.
+    A failing region is reported in the summary without stopping the others.
+    Returns {region: summary dict}, where a successful region_func returns its own summary dict
+    '''
+    summary = {}
+    regions = list(regions)
+    if not regions:
+        return summary
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(regions)))) as executor:
+        futures = {executor.submit(region_func, region): region for region in regions}
+        for future in as_completed(futures):
+            region = futures[future]
+            try:
+                summary[region] = dict(status='ok', **(future.result() or {}))
+            except Exception as error:  # pylint: disable=broad-except
+                print('Error: region {} failed: {!r}'.format(region, error))
+                summary[region] = {'status': 'error', 'error': repr(error)}
+    print_region_summary(summary)
+
+    return summary
+
+
+def save_state_json(file_name, state):
+    '''
+    Persist JSON state between runs, replacing the file atomically.
+    Values JSON cannot represent, such as datetimes, are stored as strings
+    '''
+    temp_name = '{}.tmp'.format(file_name)
+    with open(temp_name, 'w') as statefile:
+        json.dump(state, statefile, default=str)
+    os.replace(temp_name, file_name)
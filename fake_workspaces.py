@@ -0,0 +1,396 @@
+#!/usr/bin/env python
+"""
+In-process fake of the AWS WorkSpaces API, for offline tests and scale benchmarks
+Plug it in with aws_client_utils.set_client_factory(FakeWorkSpacesBackend().client_factory)
+or WorkSpaceClient(region, client_factory=...). Not packaged with the lambda functions.
+
+   Copyright 2021 Zulily, Inc.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+     http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import collections
+import datetime
+import itertools
+import random
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+DEFAULT_PATCH_DATES = ['20210705', '20210801', '20210805']
+DEFAULT_PREFIX = 'zara'
+DEFAULT_SUFFIXES = ['production', 'admin', 'test']
+DEFAULT_TEAMS = ['frontend', 'backend', 'data']
+MAX_CREATE_BATCH = 25
+PAGE_SIZE = 25
+UNMANAGED_ALIAS = 'shared'
+
+
+def client_error(code, operation, message=''):
+    '''
+    Build the ClientError botocore raises for a failed call
+    '''
+    return ClientError({'Error': {'Code': code, 'Message': message}}, operation)
+
+
+class FakeWorkSpacesService():
+    '''
+    One region of the fake WorkSpaces service, mimicking the boto client methods used here
+    '''
+    def __init__(self, region, latency=0, throttle_rate=0, seed=0):
+        '''
+        latency: seconds slept per call; throttle_rate: fraction of calls raising ThrottlingException
+        '''
+        self.region = region
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.random = random.Random(seed)
+        self.lock = threading.RLock()
+        self.ids = itertools.count(1)
+        self.calls = collections.Counter()
+        self.throttles = collections.Counter()
+        self.directories = {}
+        self.bundles = {}
+        self.images = {}
+        self.workspaces = {}
+        self.tags = {}
+
+    def api_call(self, operation):
+        '''
+        Record a call, apply the configured latency and maybe throttle it
+        '''
+        with self.lock:
+            self.calls[operation] += 1
+            throttled = self.random.random() < self.throttle_rate
+            if throttled:
+                self.throttles[operation] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if throttled:
+            raise client_error('ThrottlingException', operation, 'Rate exceeded')
+
+    def new_id(self, prefix):
+        '''
+        Return a unique resource id
+        '''
+        with self.lock:
+            return '{}-{:09x}'.format(prefix, next(self.ids))
+
+    @staticmethod
+    def page(items, key, next_token, limit):
+        '''
+        Slice one page of a describe_* response, adding NextToken when more remain
+        '''
+        start = int(next_token or 0)
+        limit = min(limit or PAGE_SIZE, PAGE_SIZE)
+        response = {key: items[start:start + limit]}
+        if start + limit < len(items):
+            response['NextToken'] = str(start + limit)
+        return response
+
+    # seeding
+
+    def add_bundle(self, name, image_name=None, creation_time=None):
+        '''
+        Add a bundle, and its image, owned by this account
+        '''
+        image_id = self.add_image(image_name or name, creation_time)
+        bundle_id = self.new_id('wsb')
+        self.bundles[bundle_id] = {'BundleId': bundle_id,
+                                   'Name': name,
+                                   'Owner': '123456789012',
+                                   'Description': 'Bundle for {}'.format(name),
+                                   'ImageId': image_id,
+                                   'RootStorage': {'Capacity': '80'},
+                                   'UserStorage': {'Capacity': '50'},
+                                   'ComputeType': {'Name': 'POWER'},
+                                   'State': 'AVAILABLE',
+                                   'CreationTime': creation_time or datetime.datetime.now(),
+                                   'LastUpdatedTime': creation_time or datetime.datetime.now()}
+        return bundle_id
+
+    def add_directory(self, alias):
+        '''
+        Add a registered directory with the given alias
+        '''
+        directory_id = self.new_id('d')
+        self.directories[directory_id] = {'DirectoryId': directory_id,
+                                          'Alias': alias,
+                                          'DirectoryName': '{}.corp.example.com'.format(alias),
+                                          'RegistrationCode': 'SLiad+{}'.format(directory_id),
+                                          'SubnetIds': ['subnet-1', 'subnet-2'],
+                                          'DnsIpAddresses': ['10.0.0.10', '10.0.0.11'],
+                                          'CustomerUserName': 'Administrator',
+                                          'DirectoryType': 'AD_CONNECTOR',
+                                          'WorkspaceSecurityGroupId': 'sg-1',
+                                          'State': 'REGISTERED'}
+        return directory_id
+
+    def add_image(self, name, creation_time=None):
+        '''
+        Add an available image owned by this account
+        '''
+        image_id = self.new_id('wsi')
+        self.images[image_id] = {'ImageId': image_id,
+                                 'Name': name,
+                                 'Description': 'Image {}'.format(name),
+                                 'OperatingSystem': {'Type': 'WINDOWS'},
+                                 'State': 'AVAILABLE',
+                                 'RequiredTenancy': 'DEDICATED',
+                                 'Created': creation_time or datetime.datetime.now(),
+                                 'OwnerAccountId': '123456789012'}
+        return image_id
+
+    def add_workspace(self, user, directory_id, bundle_id, tags=None, state='AVAILABLE'):
+        '''
+        Add a workspace for a user, as DescribeWorkspaces would report it
+        '''
+        workspace_id = self.new_id('ws')
+        self.workspaces[workspace_id] = {'WorkspaceId': workspace_id,
+                                         'DirectoryId': directory_id,
+                                         'UserName': user,
+                                         'IpAddress': '10.0.{}.{}'.format(len(self.workspaces) // 250 % 250,
+                                                                          len(self.workspaces) % 250),
+                                         'State': state,
+                                         'BundleId': bundle_id,
+                                         'SubnetId': 'subnet-1',
+                                         'ComputerName': 'WSAMZN-{}'.format(workspace_id[-7:].upper()),
+                                         'VolumeEncryptionKey': 'mrk-0123456789abcdef',
+                                         'UserVolumeEncryptionEnabled': True,
+                                         'RootVolumeEncryptionEnabled': True,
+                                         'WorkspaceProperties': {'RunningMode': 'AUTO_STOP',
+                                                                 'RunningModeAutoStopTimeoutInMinutes': 60,
+                                                                 'RootVolumeSizeGib': 80,
+                                                                 'UserVolumeSizeGib': 50,
+                                                                 'ComputeTypeName': 'POWER'},
+                                         'ModificationStates': []}
+        self.tags[workspace_id] = list(tags or [])
+        return workspace_id
+
+    def seed_fleet(self, workspaces=1000, teams=None, suffixes=None, patch_dates=None,
+                   prefix=DEFAULT_PREFIX, up_to_date=0.5, unmanaged=0.1):
+        '''
+        Seed a synthetic fleet: managed and unmanaged directories, default and per-team
+        bundles for each patch date, a few orphaned images, and `workspaces` workspaces of
+        which `up_to_date` run their team's latest bundle and `unmanaged` belong to other teams
+        '''
+        teams = teams or DEFAULT_TEAMS
+        suffixes = suffixes or DEFAULT_SUFFIXES
+        patch_dates = sorted(patch_dates or DEFAULT_PATCH_DATES)
+        directory_ids = [self.add_directory('{}-{}'.format(self.region, suffix))
+                         for suffix in suffixes]
+        unmanaged_directory = self.add_directory('{}-{}'.format(self.region, UNMANAGED_ALIAS))
+        team_bundles = {team: [] for team in teams}
+        for patch_date in patch_dates:
+            created = datetime.datetime.strptime(patch_date, '%Y%m%d')
+            self.add_bundle('{}_win10_power_{}'.format(prefix, patch_date), creation_time=created)
+            for team in teams:
+                name = '{}_win10_power_{}_{}'.format(prefix, patch_date, team)
+                team_bundles[team].append(self.add_bundle(name, creation_time=created))
+            self.add_image('{}_win10_power_{}_orphan'.format(prefix, patch_date), created)
+        other_bundle = self.add_bundle('Standard with Windows 10')
+        for index in range(workspaces):
+            team = teams[index % len(teams)]
+            user = 'user{:06d}'.format(index)
+            tags = [{'Key': 'team', 'Value': team}, {'Key': 'service', 'Value': 'workspaces'}]
+            if self.random.random() < unmanaged:
+                self.add_workspace(user, unmanaged_directory, other_bundle,
+                                   [{'Key': 'team', 'Value': 'other'}])
+            elif self.random.random() < up_to_date:
+                self.add_workspace(user, directory_ids[index % len(directory_ids)],
+                                   team_bundles[team][-1], tags)
+            else:
+                self.add_workspace(user, directory_ids[index % len(directory_ids)],
+                                   self.random.choice(team_bundles[team][:-1] or team_bundles[team]),
+                                   tags)
+
+    def seed_inventory(self, inventory):
+        '''
+        Seed the region from one region of a recorded inventory_utils store,
+        {resource type: {'fetched_at', 'items'}}, giving every resource a new id
+        '''
+        items = {key: entry['items'] for key, entry in inventory.items()}
+        directory_ids = {directory_id: self.add_directory(alias)
+                         for directory_id, alias, _ in items.get('directories', {}).values()}
+        image_names = {image_id: name for image_id, name, _ in items.get('images', {}).values()}
+        bundle_ids = {bundle_id: self.add_bundle(name, image_names.pop(image_id, None))
+                      for bundle_id, name, image_id in items.get('bundles', {}).values()}
+        for name in image_names.values():
+            self.add_image(name)
+        tags = items.get('tags', {})
+        for workspace_id, directory_id, user, bundle_id, state in items.get('workspaces', []):
+            self.add_workspace(user, directory_ids.get(directory_id, directory_id),
+                               bundle_ids.get(bundle_id, bundle_id), tags.get(workspace_id), state)
+
+    # boto client methods
+
+    def create_workspaces(self, Workspaces):  # pylint: disable=invalid-name
+        '''
+        Queue workspaces for creation, failing requests for unknown directories or bundles
+        '''
+        self.api_call('CreateWorkspaces')
+        if len(Workspaces) > MAX_CREATE_BATCH:
+            raise client_error('ValidationException', 'CreateWorkspaces',
+                               'Member must have length less than or equal to 25')
+        response = {'FailedRequests': [], 'PendingRequests': []}
+        with self.lock:
+            existing = {(i['UserName'], i['DirectoryId']) for i in self.workspaces.values()}
+        for request in Workspaces:
+            if request.get('DirectoryId') not in self.directories or \
+               request.get('BundleId') not in self.bundles:
+                response['FailedRequests'].append({'WorkspaceRequest': request,
+                                                   'ErrorCode': 'ResourceNotFound.Directory',
+                                                   'ErrorMessage': 'Invalid directory or bundle'})
+            elif (request.get('UserName'), request.get('DirectoryId')) in existing:
+                response['FailedRequests'].append({'WorkspaceRequest': request,
+                                                   'ErrorCode': 'ResourceExists.WorkSpace',
+                                                   'ErrorMessage': 'WorkSpace already exists'})
+            else:
+                with self.lock:
+                    workspace_id = self.add_workspace(request['UserName'], request['DirectoryId'],
+                                                      request['BundleId'], request.get('Tags'),
+                                                      state='PENDING')
+                    response['PendingRequests'].append(dict(self.workspaces[workspace_id]))
+        return response
+
+    def delete_workspace_bundle(self, BundleId):  # pylint: disable=invalid-name
+        '''
+        Delete a bundle that no workspace uses
+        '''
+        self.api_call('DeleteWorkspaceBundle')
+        with self.lock:
+            if BundleId not in self.bundles:
+                raise client_error('ResourceNotFoundException', 'DeleteWorkspaceBundle')
+            if any(i['BundleId'] == BundleId for i in self.workspaces.values()):
+                raise client_error('ResourceAssociatedException', 'DeleteWorkspaceBundle')
+            del self.bundles[BundleId]
+        return {}
+
+    def delete_workspace_image(self, ImageId):  # pylint: disable=invalid-name
+        '''
+        Delete an image that no bundle uses
+        '''
+        self.api_call('DeleteWorkspaceImage')
+        with self.lock:
+            if any(i['ImageId'] == ImageId for i in self.bundles.values()):
+                raise client_error('ResourceAssociatedException', 'DeleteWorkspaceImage')
+            self.images.pop(ImageId, None)
+        return {}
+
+    def describe_tags(self, ResourceId):  # pylint: disable=invalid-name
+        '''
+        Return the tags of a resource
+        '''
+        self.api_call('DescribeTags')
+        if ResourceId not in self.tags:
+            raise client_error('ResourceNotFoundException', 'DescribeTags')
+        return {'TagList': [dict(i) for i in self.tags[ResourceId]]}
+
+    def describe_workspace_bundles(self, BundleIds=None, Owner=None, NextToken=None):  # pylint: disable=invalid-name,unused-argument
+        '''
+        Page through the account's bundles
+        '''
+        self.api_call('DescribeWorkspaceBundles')
+        with self.lock:
+            bundles = [dict(i) for i in self.bundles.values()
+                       if not BundleIds or i['BundleId'] in BundleIds]
+        return self.page(bundles, 'Bundles', NextToken, PAGE_SIZE)
+
+    def describe_workspace_directories(self, DirectoryIds=None, Limit=None, NextToken=None):  # pylint: disable=invalid-name
+        '''
+        Page through the registered directories
+        '''
+        self.api_call('DescribeWorkspaceDirectories')
+        with self.lock:
+            directories = [dict(i) for i in self.directories.values()
+                           if not DirectoryIds or i['DirectoryId'] in DirectoryIds]
+        return self.page(directories, 'Directories', NextToken, Limit)
+
+    def describe_workspace_images(self, ImageIds=None, NextToken=None, MaxResults=None):  # pylint: disable=invalid-name
+        '''
+        Page through the account's images
+        '''
+        self.api_call('DescribeWorkspaceImages')
+        with self.lock:
+            images = [dict(i) for i in self.images.values()
+                      if not ImageIds or i['ImageId'] in ImageIds]
+        return self.page(images, 'Images', NextToken, MaxResults)
+
+    def describe_workspaces(self, WorkspaceIds=None, DirectoryId=None, UserName=None,  # pylint: disable=invalid-name
+                            BundleId=None, Limit=None, NextToken=None):
+        '''
+        Page through the workspaces, applying the server-side filters DescribeWorkspaces supports
+        '''
+        self.api_call('DescribeWorkspaces')
+        with self.lock:
+            workspaces = [dict(i) for i in self.workspaces.values()
+                          if (not WorkspaceIds or i['WorkspaceId'] in WorkspaceIds) and
+                          (not DirectoryId or i['DirectoryId'] == DirectoryId) and
+                          (not UserName or i['UserName'] == UserName) and
+                          (not BundleId or i['BundleId'] == BundleId)]
+        return self.page(workspaces, 'Workspaces', NextToken, Limit)
+
+    def migrate_workspace(self, SourceWorkspaceId, BundleId):  # pylint: disable=invalid-name
+        '''
+        Move a workspace to a new bundle, as a new workspace id in MIGRATING state
+        '''
+        self.api_call('MigrateWorkspace')
+        with self.lock:
+            if SourceWorkspaceId not in self.workspaces or BundleId not in self.bundles:
+                raise client_error('ResourceNotFoundException', 'MigrateWorkspace')
+            source = self.workspaces.pop(SourceWorkspaceId)
+            target_id = self.new_id('ws')
+            self.workspaces[target_id] = dict(source, WorkspaceId=target_id, BundleId=BundleId,
+                                              State='MIGRATING')
+            self.tags[target_id] = self.tags.pop(SourceWorkspaceId, [])
+        return {'SourceWorkspaceId': SourceWorkspaceId, 'TargetWorkspaceId': target_id}
+
+
+class FakeWorkSpacesBackend():
+    '''
+    A set of fake WorkSpaces regions, handed out by client_factory
+    '''
+    def __init__(self, latency=0, throttle_rate=0, seed=0):
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.seed = seed
+        self.lock = threading.Lock()
+        self.services = {}
+
+    def client_factory(self, service, region):
+        '''
+        Factory for aws_client_utils.set_client_factory and WorkSpaceClient
+        '''
+        if service != 'workspaces':
+            raise ValueError('No fake available for service {}'.format(service))
+        return self.region(region)
+
+    def region(self, region):
+        '''
+        Return the fake service for a region, creating it on first use
+        '''
+        with self.lock:
+            if region not in self.services:
+                self.services[region] = FakeWorkSpacesService(region, self.latency,
+                                                              self.throttle_rate, self.seed)
+            return self.services[region]
+
+    def total_calls(self):
+        '''
+        Calls per operation summed across all regions
+        '''
+        calls = collections.Counter()
+        for service in self.services.values():
+            calls.update(service.calls)
+        return calls
@@ -6,12 +6,46 @@ Utility client for interacting with your gitlab instance.
 import base64
 import json
 import sys
+import threading
+import time
 import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
 from requests import Session
 from requests.adapters import HTTPAdapter
 from requests.packages.urllib3.util.retry import Retry
 
+import metrics_utils as metrics
+
 DORA_METRIC_LIST = ['deployment_frequency', 'lead_time_for_changes']
+DORA_WORKERS = 8
+# (path marker, kind) of the GitLab endpoints used, most specific first
+ENDPOINT_KINDS = [('/-/liveness', 'liveness'),
+                  ('/repository/files/', 'files'),
+                  ('/dora/metrics', 'dora/metrics'),
+                  ('/projects', 'projects'),
+                  ('/search', 'search')]
+PAGE_WORKERS = 4
+# pause all requests once fewer than RATE_LIMIT_FLOOR remain in GitLab's window
+RATE_LIMIT_FLOOR = 2
+RATE_LIMIT_MAX_PAUSE = 60
+
+def endpoint_kind(url):
+    '''
+    The kind of GitLab endpoint a url requests, e.g. files or dora/metrics, for metrics
+    '''
+    path = urllib.parse.urlsplit(url).path
+    return next((kind for marker, kind in ENDPOINT_KINDS if marker in path), 'other')
+
+
+def set_page(url, page):
+    '''
+    Return url with its page query parameter replaced
+    '''
+    parts = urllib.parse.urlsplit(url)
+    query = dict(urllib.parse.parse_qsl(parts.query, keep_blank_values=True))
+    query['page'] = str(page)
+    return urllib.parse.urlunsplit(parts._replace(query=urllib.parse.urlencode(query)))
+
 
 class TimeoutHTTPAdapter(HTTPAdapter):
     '''
@@ -40,9 +74,15 @@ class GitLabClient():
         self.url = url
         self.token = token
         retries = Retry(total=3, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504])
+        pool_size = max(DORA_WORKERS, PAGE_WORKERS)
+        self.host = urllib.parse.urlparse(url).netloc
         self.http = Session()
-        self.http.mount("https://", TimeoutHTTPAdapter(timeout=10, max_retries=retries))
-        self.http.mount("http://", TimeoutHTTPAdapter(timeout=10, max_retries=retries))
+        self.http.mount("https://", TimeoutHTTPAdapter(timeout=10, max_retries=retries,
+                                                       pool_maxsize=pool_size))
+        self.http.mount("http://", TimeoutHTTPAdapter(timeout=10, max_retries=retries,
+                                                      pool_maxsize=pool_size))
+        self.rate_lock = threading.Lock()
+        self.resume_at = 0
 
 
     def check_gitlab_alive(self):
@@ -53,32 +93,59 @@ class GitLabClient():
         headers = {}
         headers['PRIVATE-TOKEN'] = self.token
         url = "{}/-/liveness".format(self.url)
-        req = self.http.get(url, headers=headers, timeout=10)
+        req = self.request('get', url, headers=headers, timeout=10)
         if req.ok:
-            rval = json.loads(req.text)
+            rval = req.json()
             if rval == {"status":"ok"}:
                 status = True
         return status
 
 
+    def get(self, url, headers):
+        '''
+        GET a url, waiting out and recording GitLab rate limits shared by all threads
+        '''
+        delay = self.resume_at - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        response = self.request('get', url, headers=headers)
+        self.respect_rate_limit(response)
+        return response
+
     def get_dora_metrics(self, group_project, prod_label, start_date):
         '''
         retrieve the daily dora metrics matching the start_date (yesterday)
         '''
+        return list(self.iter_dora_metrics(group_project, prod_label, start_date))
+
+    def get_dora_metrics_bulk(self, projects, prod_label, start_date, max_workers=DORA_WORKERS):
+        '''
+        retrieve the daily dora metrics for many projects concurrently, as one flat list.
+        projects may be project paths or project records from get_group_projects
+        '''
+        pairs = [(project.get('path_with_namespace') if isinstance(project, dict) else project,
+                  metric) for project in projects for metric in DORA_METRIC_LIST]
         metrics = []
-        project = urllib.parse.quote_plus(group_project)
-        for metric in DORA_METRIC_LIST:
-            endpoint = "projects/{}/dora/metrics?metric={}&start_date={}&environment_tier={}".format(
-		        project, metric, start_date, prod_label)
-            metric_results = self.query_gitlab(endpoint)
-            for metric_result in metric_results:
-                if metric_result.get('date') == start_date:
-                    # correct metric
-                    metric_result['project'] = group_project
-                    metric_result['metric'] = metric
-                    metrics.append(metric_result)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for metric_results in executor.map(
+                    lambda pair: list(self.iter_dora_metric(pair[0], pair[1],
+                                                            prod_label, start_date)),
+                    pairs):
+                metrics.extend(metric_results)
         return metrics
 
+    def get_file_commit_id(self, project_id, filename, branch):
+        '''
+        Retrieve the id of the last commit to modify a file, without downloading its content
+        '''
+        endpoint = "projects/{}/repository/files/{}?ref={}".format(project_id,
+                                                                   filename,
+                                                                   branch)
+        headers = self.query_gitlab_headers(endpoint)
+        if headers is None:
+            return None
+        return headers.get('X-Gitlab-Last-Commit-Id')
+
     def get_group_projects(self, group_prefix):
         '''
         Retrieve all projects under a given group/subgroup
@@ -108,6 +175,53 @@ class GitLabClient():
             sys.exit(1)
         return file_object
 
+    def iter_dora_metrics(self, group_project, prod_label, start_date):
+        '''
+        yield the daily dora metrics matching the start_date (yesterday) as they arrive
+        '''
+        for metric in DORA_METRIC_LIST:
+            yield from self.iter_dora_metric(group_project, metric, prod_label, start_date)
+
+    def iter_dora_metric(self, group_project, metric, prod_label, start_date):
+        '''
+        yield a single daily dora metric matching the start_date (yesterday)
+        '''
+        project = urllib.parse.quote_plus(group_project)
+        endpoint = "projects/{}/dora/metrics?metric={}&start_date={}&environment_tier={}".format(
+            project, metric, start_date, prod_label)
+        for metric_result in self.iter_gitlab(endpoint):
+            if metric_result.get('date') == start_date:
+                # correct metric
+                metric_result['project'] = group_project
+                metric_result['metric'] = metric
+                yield metric_result
+
+    def iter_gitlab(self, endpoint):
+        '''
+        request a collection endpoint from gitlab, yielding records page by page as they arrive
+        so callers can filter or stop early without holding the whole collection
+        '''
+        url = "{}/api/v4/{}".format(self.url, endpoint)
+        headers = {}
+        headers['PRIVATE-TOKEN'] = self.token
+        while url:
+            response = self.get(url, headers)
+            if response.status_code == 404:
+                return
+            response.raise_for_status()
+            yield from response.json()
+            next_link = response.links.get('next')
+            url = next_link.get('url') if next_link else None
+
+    def iter_group_projects(self, group_prefix):
+        '''
+        yield all projects under a given group/subgroup
+        (including all children's children) page by page
+        '''
+        group = urllib.parse.quote_plus(group_prefix)
+        endpoint = "groups/{}/projects?include_subgroups=true".format(group)
+        return self.iter_gitlab(endpoint)
+
     def query_gitlab(self, endpoint):
         '''
         request endpoint from gitlab
@@ -115,28 +229,87 @@ class GitLabClient():
         url = "{}/api/v4/{}".format(self.url, endpoint)
         headers = {}
         headers['PRIVATE-TOKEN'] = self.token
-        response = self.http.get(url, headers=headers)
+        response = self.get(url, headers)
         if response.status_code == 404:
             return None
         if response.ok:
             if response.links.get('next'):
-                return self.query_gitlab_paginated(response.text, response, headers)
-            return json.loads(response.text)
+                return self.query_gitlab_paginated(response.json(), response, headers)
+            return response.json()
+        response.raise_for_status()
+        sys.exit(1)
+
+    def query_gitlab_headers(self, endpoint):
+        '''
+        request only the headers of an endpoint from gitlab
+        '''
+        url = "{}/api/v4/{}".format(self.url, endpoint)
+        headers = {}
+        headers['PRIVATE-TOKEN'] = self.token
+        response = self.request('head', url, headers=headers)
+        if response.status_code == 404:
+            return None
+        if response.ok:
+            return response.headers
         response.raise_for_status()
         sys.exit(1)
 
+    def query_gitlab_page(self, url, headers):
+        '''
+        request a single page of results from gitlab
+        '''
+        response = self.get(url, headers)
+        response.raise_for_status()
+        return response.json()
+
     def query_gitlab_paginated(self, existing, response, headers):
         '''
         request endpoint from gitlab with pagination
+        When GitLab reports X-Total-Pages, the remaining pages are fetched concurrently;
+        otherwise (e.g. keyset pagination or very large collections) Link: next is followed.
+        Results are always returned in page order.
         '''
-        results = json.loads(existing)
+        results = list(existing)
+        total_pages = response.headers.get('X-Total-Pages')
+        if total_pages:
+            next_url = response.links.get('next').get('url')
+            urls = [set_page(next_url, page) for page in range(2, int(total_pages) + 1)]
+            with ThreadPoolExecutor(max_workers=PAGE_WORKERS) as executor:
+                for page in executor.map(lambda url: self.query_gitlab_page(url, headers), urls):
+                    results.extend(page)
+            return results
         while response.links.get('next'):
             url = response.links.get('next').get('url')
-            response = self.http.get(url, headers=headers)
+            response = self.get(url, headers)
             if response.ok:
-                results.extend(json.loads(response.text))
+                results.extend(response.json())
         return results
 
+    def request(self, method, url, **kwargs):
+        '''
+        Send a GET or HEAD request, recording it in metrics_utils under the endpoint's kind
+        '''
+        operation = endpoint_kind(url)
+        if method != 'get':
+            operation = '{}:{}'.format(operation, method)
+        return metrics.call_timed('GitLab', operation, self.host, getattr(self.http, method),
+                                  url, **kwargs)
+
+    def respect_rate_limit(self, response):
+        '''
+        Pause later requests when GitLab sends Retry-After or RateLimit-Remaining runs low
+        '''
+        delay = 0
+        if response.headers.get('Retry-After'):
+            delay = float(response.headers.get('Retry-After'))
+        elif int(response.headers.get('RateLimit-Remaining', RATE_LIMIT_FLOOR)) < RATE_LIMIT_FLOOR:
+            reset = response.headers.get('RateLimit-Reset')
+            delay = float(reset) - time.time() if reset else 1
+        if delay > 0:
+            with self.rate_lock:
+                self.resume_at = max(self.resume_at,
+                                     time.time() + min(delay, RATE_LIMIT_MAX_PAUSE))
+
     def search_projects(self, group_prefix):
         '''
         search projects from gitlab
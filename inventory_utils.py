@@ -0,0 +1,150 @@
+"""
+File-backed inventory store shared by the workspace lambda functions between runs
+"""
+
+import os
+import threading
+import time
+
+import common_utils as utils
+
+# seconds each resource type is served from the store before it is listed again;
+# workspaces change with every create and migration, so they are always listed by default
+INVENTORY_TTLS = {'directories': 3600,
+                  'bundles': 900,
+                  'images': 900,
+                  'workspaces': 0,
+                  'tags': 86400}
+# stores live at module level so that warm Lambda invocations skip re-reading them
+STORE_CACHE = {}
+STORE_LOCK = threading.Lock()
+
+
+class InventoryStore():
+    '''
+    One JSON document of {region: {resource type: {'fetched_at', 'items'}}}.
+    Datetimes in stored items come back as strings. Since several functions may share the file,
+    reloading and saving merge it per region and resource type: the resource types this store
+    put or expired since its last save are kept over older entries in the file, and every
+    other entry is taken from the file
+    '''
+    def __init__(self, file_name, ttls=None):
+        self.file_name = file_name
+        self.ttls = dict(INVENTORY_TTLS, **(ttls or {}))
+        self.lock = threading.Lock()
+        self.mtime = file_mtime(file_name)
+        self.state = utils.load_state_json(file_name)
+        # {(region, resource type): time} expired, and the set put, since the last save
+        self.expired = {}
+        self.puts = set()
+
+    def expire(self, region, *resource_types):
+        '''
+        Drop resource types of a region, e.g. after changing them
+        '''
+        with self.lock:
+            for resource_type in resource_types:
+                self.state.get(region, {}).pop(resource_type, None)
+                self.expired[(region, resource_type)] = time.time()
+                self.puts.discard((region, resource_type))
+
+    def fetched_at(self, region, resource_type):
+        '''
+        When the stored items were listed, or None if there are none
+        '''
+        with self.lock:
+            entry = self.state.get(region, {}).get(resource_type)
+        return entry['fetched_at'] if entry else None
+
+    def get(self, region, resource_type):
+        '''
+        Return the stored items if they are younger than the type's TTL, otherwise None
+        '''
+        with self.lock:
+            entry = self.state.get(region, {}).get(resource_type)
+        if not entry or time.time() - entry['fetched_at'] >= self.ttls.get(resource_type, 0):
+            return None
+        return entry['items']
+
+    def merge_file(self):
+        '''
+        Replace the state with the file's, keeping this store's puts and expirations over
+        entries in the file fetched before them. Called with the lock held
+        '''
+        self.mtime = file_mtime(self.file_name)
+        state = utils.load_state_json(self.file_name)
+        for (region, resource_type), expired_at in self.expired.items():
+            entry = state.get(region, {}).get(resource_type)
+            if entry and entry['fetched_at'] <= expired_at:
+                del state[region][resource_type]
+        for region, resource_type in self.puts:
+            entry = self.state[region][resource_type]
+            stored = state.get(region, {}).get(resource_type)
+            if not stored or stored['fetched_at'] <= entry['fetched_at']:
+                state.setdefault(region, {})[resource_type] = entry
+        self.state = state
+
+    def put(self, region, resource_type, items, fetched_at=None):
+        '''
+        Store freshly listed items; fetched_at defaults to now
+        '''
+        with self.lock:
+            self.state.setdefault(region, {})[resource_type] = {
+                'fetched_at': fetched_at or time.time(), 'items': items}
+            self.puts.add((region, resource_type))
+
+    def reload(self):
+        '''
+        Merge in what other functions saved to the file since it was last read
+        '''
+        with self.lock:
+            self.merge_file()
+
+    def save(self):
+        '''
+        Merge the file, then persist the store, replacing the file atomically
+        '''
+        with self.lock:
+            self.merge_file()
+            utils.save_state_json(self.file_name, self.state)
+            self.mtime = file_mtime(self.file_name)
+            self.expired = {}
+            self.puts = set()
+
+
+def file_mtime(file_name):
+    '''
+    Modification time of file_name, or None if it does not exist
+    '''
+    try:
+        return os.stat(file_name).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def get_store(config):
+    '''
+    Return the shared store for the config's inventory_file, or None when it is not set.
+    What another function has saved to the file since is merged into the same store
+    '''
+    file_name = config.get('inventory_file')
+    if not file_name:
+        return None
+    with STORE_LOCK:
+        store = STORE_CACHE.get(file_name)
+        if not store:
+            store = STORE_CACHE[file_name] = InventoryStore(file_name,
+                                                            config.get('inventory_ttls'))
+        elif store.mtime != file_mtime(file_name):
+            store.reload()
+        return store
+
+
+def save_store(config):
+    '''
+    Persist the store the run used for the config's inventory_file, if any, at the end of a run
+    '''
+    with STORE_LOCK:
+        store = STORE_CACHE.get(config.get('inventory_file'))
+    if store:
+        store.save()
@@ -0,0 +1,181 @@
+"""
+API call metrics for the AWS and GitLab clients, emitted at the end of each handler run
+as CloudWatch Embedded Metric Format log lines (or plain JSON outside of AWS Lambda)
+"""
+
+import collections
+import functools
+import json
+import os
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+# upper bounds, in milliseconds, of the latency histogram buckets
+LATENCY_BUCKETS_MS = [10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+METRICS_NAMESPACE = 'AWSWorkspaceMaker'
+THROTTLE_CODES = {'ThrottlingException', 'RequestLimitExceeded', 'TooManyRequestsException', '429'}
+# metrics live at module level so that every client in a run records into one place
+METRICS_LOCK = threading.Lock()
+METRICS = {}
+
+
+class CallStats():
+    '''
+    Counters and a latency histogram for one (service, operation, region)
+    '''
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.throttles = 0
+        self.retries = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+
+    def add(self, elapsed_ms, error_code):
+        '''
+        Record one call
+        '''
+        self.calls += 1
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        self.buckets[next((index for index, bound in enumerate(LATENCY_BUCKETS_MS)
+                           if elapsed_ms <= bound), len(LATENCY_BUCKETS_MS))] += 1
+        if error_code:
+            self.errors += 1
+            if error_code in THROTTLE_CODES:
+                self.throttles += 1
+
+    def histogram(self):
+        '''
+        Non-empty buckets as EMF values (bucket upper bounds, the last one the maximum) and counts
+        '''
+        bounds = LATENCY_BUCKETS_MS + [max(self.max_ms, LATENCY_BUCKETS_MS[-1])]
+        pairs = [(bound, count) for bound, count in zip(bounds, self.buckets) if count]
+        return {'Values': [i[0] for i in pairs], 'Counts': [i[1] for i in pairs]}
+
+
+class InstrumentedClient():
+    '''
+    Proxy timing every method call of a boto client
+    '''
+    def __init__(self, client, service, region):
+        self.client = client
+        self.service = service
+        self.region = region
+
+    def __getattr__(self, name):
+        attr = getattr(self.client, name)
+        if not callable(attr):
+            return attr
+
+        def timed(*args, **kwargs):
+            return call_timed(self.service, name, self.region, attr, *args, **kwargs)
+
+        timed.metric_key = (self.service, name, self.region)
+        return timed
+
+
+def call_timed(service, operation, region, func, *args, **kwargs):
+    '''
+    Call func, recording it as one call of operation. A ClientError's code, another exception's
+    class name or a response status of 400 and above counts as an error
+    '''
+    start = time.perf_counter()
+    error_code = None
+    try:
+        result = func(*args, **kwargs)
+        status = getattr(result, 'status_code', 200)
+        if isinstance(status, int) and status >= 400:
+            error_code = str(status)
+        return result
+    except ClientError as err:
+        error_code = err.response['Error'].get('Code')
+        raise
+    except Exception as err:
+        error_code = type(err).__name__
+        raise
+    finally:
+        record(service, operation, region, (time.perf_counter() - start) * 1000, error_code)
+
+
+def emit(function_name, namespace=METRICS_NAMESPACE):
+    '''
+    Log one line per (service, operation, region) recorded since the last emit, then reset.
+    Inside AWS Lambda the lines are CloudWatch Embedded Metric Format
+    '''
+    with METRICS_LOCK:
+        metrics = dict(METRICS)
+        METRICS.clear()
+    in_lambda = bool(os.environ.get('AWS_LAMBDA_FUNCTION_NAME'))
+    timestamp = int(time.time() * 1000)
+    for (service, operation, region), stats in sorted(metrics.items()):
+        line = {'Function': function_name, 'Service': service, 'Operation': operation,
+                'Region': region, 'Calls': stats.calls, 'Errors': stats.errors,
+                'Throttles': stats.throttles, 'Retries': stats.retries}
+        if in_lambda:
+            line['Latency'] = stats.histogram()
+            line['_aws'] = {'Timestamp': timestamp, 'CloudWatchMetrics': [{
+                'Namespace': namespace,
+                'Dimensions': [['Function', 'Service', 'Operation', 'Region']],
+                'Metrics': [{'Name': 'Calls', 'Unit': 'Count'},
+                            {'Name': 'Errors', 'Unit': 'Count'},
+                            {'Name': 'Throttles', 'Unit': 'Count'},
+                            {'Name': 'Retries', 'Unit': 'Count'},
+                            {'Name': 'Latency', 'Unit': 'Milliseconds'}]}]}
+        else:
+            line.update({'LatencyMs': {'mean': round(stats.total_ms / max(stats.calls, 1), 2),
+                                       'max': round(stats.max_ms, 2),
+                                       'histogram': stats.histogram()}})
+        print(json.dumps(line))
+
+
+def emitted(function_name):
+    '''
+    Decorate a handler so that its metrics are emitted however it returns or exits
+    '''
+    def decorate(handler):
+        @functools.wraps(handler)
+        def wrapper(*args, **kwargs):
+            try:
+                return handler(*args, **kwargs)
+            finally:
+                emit(function_name)
+        return wrapper
+    return decorate
+
+
+def instrument(client, service, region):
+    '''
+    Wrap a boto client so that its calls are recorded under their method names
+    '''
+    return InstrumentedClient(client, service, region)
+
+
+def record(service, operation, region, elapsed_ms, error_code=None):
+    '''
+    Record one call of an operation
+    '''
+    with METRICS_LOCK:
+        stats = METRICS.setdefault((service, operation, region), CallStats())
+        stats.add(elapsed_ms, error_code)
+
+
+def record_retry(func):
+    '''
+    Count a retry of an instrumented call; other callables are ignored
+    '''
+    key = getattr(func, 'metric_key', None)
+    if key:
+        with METRICS_LOCK:
+            METRICS.setdefault(key, CallStats()).retries += 1
+
+
+def snapshot():
+    '''
+    A copy of the metrics recorded so far, as {(service, operation, region): CallStats}
+    '''
+    with METRICS_LOCK:
+        return collections.OrderedDict(sorted(METRICS.items()))
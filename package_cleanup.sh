@@ -6,6 +6,9 @@ rm aws_workspace_cleanup.zip
 cp workspacecleanup.py dist_cleanup
 cp *_utils.py dist_cleanup
 cp -R config dist_cleanup
-pip install -r requirements.txt -t dist_cleanup
+# lean build: rely on the boto3/botocore bundled in the AWS Lambda python runtime
+if [ -z "$LEAN_BUILD" ]; then
+    pip install -r requirements.txt -t dist_cleanup
+fi
 
 (cd dist_cleanup && zip -r ../aws_workspace_cleanup *)
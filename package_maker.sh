@@ -6,6 +6,11 @@ rm aws_workspace_maker.zip
 cp workspacer.py dist_maker
 cp *_utils.py dist_maker
 cp -R config dist_maker
-pip install -r requirements.txt -t dist_maker
+if [ -n "$LEAN_BUILD" ]; then
+    # lean build: rely on the boto3/botocore bundled in the AWS Lambda python runtime
+    pip install -r requirements-lambda.txt -t dist_maker
+else
+    pip install -r requirements.txt -t dist_maker
+fi
 
 (cd dist_maker && zip -r ../aws_workspace_maker *)
@@ -6,6 +6,9 @@ rm aws_workspace_refresh.zip
 cp workspacerefresh.py dist_refresh
 cp *_utils.py dist_refresh
 cp -R config dist_refresh
-pip install -r requirements.txt -t dist_refresh
+# lean build: rely on the boto3/botocore bundled in the AWS Lambda python runtime
+if [ -z "$LEAN_BUILD" ]; then
+    pip install -r requirements.txt -t dist_refresh
+fi
 
 (cd dist_refresh && zip -r ../aws_workspace_refresh *)
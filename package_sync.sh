@@ -0,0 +1,17 @@
+#!/usr/bin/env bash
+mkdir -p dist_sync
+rm -rf dist_sync/*
+rm aws_workspace_sync.zip
+
+# the single-pass handler drives the maker, refresh and cleanup planners
+cp workspacesync.py workspacer.py workspacerefresh.py workspacecleanup.py dist_sync
+cp *_utils.py dist_sync
+cp -R config dist_sync
+if [ -n "$LEAN_BUILD" ]; then
+    # lean build: rely on the boto3/botocore bundled in the AWS Lambda python runtime
+    pip install -r requirements-lambda.txt -t dist_sync
+else
+    pip install -r requirements.txt -t dist_sync
+fi
+
+(cd dist_sync && zip -r ../aws_workspace_sync *)
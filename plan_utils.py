@@ -0,0 +1,301 @@
+"""
+Plan/apply engine shared by the workspace lambda functions
+A RegionSnapshot lists each part of a region's inventory at most once, for every planner.
+Planners build a RegionPlan from it, which is then applied through an executor or, in a
+dry run, printed with an estimate of the API calls it needs
+"""
+
+import math
+
+import aws_workspace_utils as aws_ws
+import common_utils as utils
+import inventory_utils as inventory
+
+# migrations are unpaced unless migration_rate is set
+MIGRATION_RATE = None
+# the record type of each stored inventory, which the store keeps as plain lists
+RECORD_TYPES = {'bundles': aws_ws.Bundle,
+                'directories': aws_ws.Directory,
+                'images': aws_ws.Image,
+                'workspaces': aws_ws.Workspace}
+
+
+class RegionSnapshot():
+    '''
+    The inventory of one region, listed lazily and kept for the rest of the run.
+    Mutations applied later are not reflected, which only ever makes cleanup keep
+    a bundle one run longer. With an inventory_utils.InventoryStore, resource types
+    still within their TTL are read from the store instead of being listed again
+    '''
+    def __init__(self, client, region, suffixes, store=None):
+        '''
+        Read the region through client; suffixes name the managed directories
+        '''
+        self.client = client
+        self.region = region
+        self.suffixes = suffixes
+        self.store = store
+        self.cache = {}
+
+    def cached(self, key, fetch):
+        '''
+        Return the cached value for key, calling fetch on first use
+        '''
+        if key not in self.cache:
+            self.cache[key] = fetch()
+        return self.cache[key]
+
+    def expire(self, plan):
+        '''
+        Drop from the store whatever applying plan changed
+        '''
+        if not self.store:
+            return
+        if plan.creates or plan.migrations:
+            self.store.expire(self.region, 'workspaces')
+        if plan.bundle_deletes or plan.image_deletes:
+            self.store.expire(self.region, 'bundles', 'images')
+
+    def stored(self, key, fetch):
+        '''
+        Return the cached value for key, reading it from the store or calling fetch on first use
+        '''
+        def read_through():
+            items = self.store.get(self.region, key) if self.store else None
+            if items is not None:
+                return load_records(key, items)
+            items = fetch()
+            if self.store:
+                self.store.put(self.region, key, items)
+            return items
+
+        return self.cached(key, read_through)
+
+    @property
+    def bundles(self):
+        '''
+        {Name: bundle} for every bundle in the region
+        '''
+        return self.stored('bundles', self.client.get_current_bundles)
+
+    @property
+    def directories(self):
+        '''
+        {Alias: directory} for every directory in the region
+        '''
+        return self.stored('directories', self.client.get_current_directories)
+
+    @property
+    def images(self):
+        '''
+        {Name: image} for every image in the region
+        '''
+        return self.stored('images', self.client.get_current_images)
+
+    @property
+    def managed_ids(self):
+        '''
+        The ids of the managed directories
+        '''
+        return self.cached('managed_ids', lambda: utils.get_directory_ids(
+            self.region, self.suffixes, self.directories))
+
+    @property
+    def managed_workspaces(self):
+        '''
+        The workspaces in managed directories, filtered locally once the whole region is listed
+        '''
+        if 'workspaces' not in self.cache and self.store:
+            stored = self.store.get(self.region, 'workspaces')
+            if stored is not None:
+                self.cache['workspaces'] = load_records('workspaces', stored)
+        if 'workspaces' in self.cache:
+            managed_ids = set(self.managed_ids)
+            return self.cached('managed_workspaces', lambda: [
+                i for i in self.workspaces if i.get('DirectoryId') in managed_ids])
+        return self.cached('managed_workspaces',
+                           lambda: self.client.get_current_workspaces(self.managed_ids))
+
+    @property
+    def tags(self):
+        '''
+        {WorkspaceId: tags} for the managed workspaces
+        '''
+        return self.cached('tags', self.fetch_tags)
+
+    def fetch_tags(self):
+        '''
+        Look up the tags of the managed workspaces. With a store, only the workspaces
+        not seen within the tags TTL are looked up, since migrations give new ids
+        '''
+        workspace_ids = [i.get('WorkspaceId') for i in self.managed_workspaces]
+        known = (self.store.get(self.region, 'tags') if self.store else None) or {}
+        tag_map = {i: known[i] for i in workspace_ids if known.get(i) is not None}
+        tag_map.update(self.client.get_tags_bulk([i for i in workspace_ids if i not in tag_map]))
+        if self.store:
+            fetched_at = self.store.fetched_at(self.region, 'tags') if known else None
+            self.store.put(self.region, 'tags', tag_map, fetched_at)
+
+        return tag_map
+
+    @property
+    def workspaces(self):
+        '''
+        Every workspace in the region, managed or not
+        '''
+        return self.stored('workspaces', self.client.get_current_workspaces)
+
+
+class RegionPlan():
+    '''
+    The creates, migrations and bundle/image deletes planned for one region
+    '''
+    def __init__(self, region):
+        self.region = region
+        # CreateWorkspaces requests
+        self.creates = []
+        # user requests that could not be planned, e.g. for a missing directory or bundle
+        self.dropped = []
+        # {'UserName', 'Team', 'WorkSpaceId', 'BundleId'} of each migration
+        self.migrations = []
+        # migrations left for a later run, and where that run resumes
+        self.deferred = 0
+        self.cursor = None
+        self.bundle_deletes = []
+        self.image_deletes = []
+        # {image_id: [bundle ids referencing it]}
+        self.image_bundles = {}
+        # {bundle name: reason} of the bundles cleanup keeps
+        self.kept = {}
+
+    def counts(self):
+        '''
+        Number of planned changes of each kind
+        '''
+        return {'creates': len(self.creates),
+                'migrations': len(self.migrations),
+                'bundle_deletes': len(self.bundle_deletes),
+                'image_deletes': len(self.image_deletes)}
+
+    def estimate_api_calls(self):
+        '''
+        Mutating API calls needed to apply the plan, before any retries
+        '''
+        return {'CreateWorkspaces': math.ceil(len(self.creates) / aws_ws.MAX_CREATE_BATCH),
+                'MigrateWorkspace': len(self.migrations),
+                'DeleteWorkspaceBundle': len(self.bundle_deletes),
+                'DeleteWorkspaceImage': len(self.image_deletes)}
+
+
+def apply_plan(plan, executor, config, snapshot=None):
+    '''
+    Apply a plan through executor, a WorkSpaceClient or anything with its bulk mutation methods,
+    then expire what it changed from the snapshot's store.
+    Returns {'creates': {(UserName, DirectoryId): {'Success', 'Detail'}},
+             'migrations': {WorkSpaceId: {'Success', 'Error'}},
+             'deletes': {resource id: {'Type', 'Success', 'Error'}}}
+    '''
+    report = {'creates': {}, 'migrations': {}, 'deletes': {}}
+    if plan.creates:
+        pending, failed = executor.create_workspaces(plan.creates)
+        for workspace in pending:
+            report['creates'][(workspace.get('UserName'), workspace.get('DirectoryId'))] = \
+                {'Success': True, 'Detail': workspace}
+        for failure in failed:
+            request = failure.get('WorkspaceRequest', {})
+            report['creates'][(request.get('UserName'), request.get('DirectoryId'))] = \
+                {'Success': False, 'Detail': failure}
+        for (user, _), result in report['creates'].items():
+            if result['Success']:
+                print("Success: Creating workspace for user {}".format(user))
+            else:
+                print("Error: Failed to create workspace for user {}".format(user))
+                for line in result['Detail'].keys():
+                    print("detail:{}: {}".format(line, result['Detail'][line]))
+    if plan.migrations:
+        for workspace in plan.migrations:
+            print('Migrating user {} in region {}'.format(workspace.get('UserName'), plan.region))
+        report['migrations'] = executor.migrate_workspaces(
+            [(i.get('WorkSpaceId'), i.get('BundleId')) for i in plan.migrations],
+            config.get('migration_concurrency', aws_ws.MIGRATION_WORKERS),
+            utils.RateLimiter(config.get('migration_rate', MIGRATION_RATE)))
+        for workspace_id, result in report['migrations'].items():
+            if not result['Success']:
+                print('Error: Failed to migrate workspace {} in region {}: {}'.format(
+                    workspace_id, plan.region, result['Error']))
+    if plan.bundle_deletes or plan.image_deletes:
+        report['deletes'] = executor.delete_bundles_and_images(
+            plan.bundle_deletes, plan.image_deletes, plan.image_bundles,
+            config.get('delete_concurrency', aws_ws.DELETE_WORKERS))
+        for resource_id, result in report['deletes'].items():
+            if result['Success']:
+                print('Deleted {}id {} in region {}'.format(result['Type'], resource_id,
+                                                           plan.region))
+            else:
+                print('Error: Failed to delete {}id {} in region {}: {}'.format(
+                    result['Type'], resource_id, plan.region, result['Error']))
+    if snapshot:
+        snapshot.expire(plan)
+
+    return report
+
+
+def is_dry_run(config, event):
+    '''
+    A run only plans when the config or the invoking event sets dry_run
+    '''
+    return bool(config.get('dry_run') or (isinstance(event, dict) and event.get('dry_run')))
+
+
+def load_records(key, items):
+    '''
+    Rebuild the records of a stored inventory, a list or a {name: record} map
+    '''
+    record_type = RECORD_TYPES[key]
+    if isinstance(items, dict):
+        return {name: record_type._make(item) for name, item in items.items()}
+    return [record_type._make(item) for item in items]
+
+
+def new_client(region, config):
+    '''
+    A WorkSpaceClient for the region with an HTTP connection for every worker of the widest
+    concurrent call the config allows
+    '''
+    return aws_ws.WorkSpaceClient(region, pool_connections=max(
+        aws_ws.POOL_CONNECTIONS,
+        config.get('migration_concurrency', aws_ws.MIGRATION_WORKERS),
+        config.get('delete_concurrency', aws_ws.DELETE_WORKERS)))
+
+
+def new_snapshot(client, region, config):
+    '''
+    Start a region snapshot, reading through the config's inventory store if there is one
+    '''
+    return RegionSnapshot(client, region, config['directory_suffixes'],
+                          inventory.get_store(config))
+
+
+def print_plan(plan):
+    '''
+    Log every planned change and the API calls needed to apply them, for dry runs
+    '''
+    for request in plan.creates:
+        print('DRY RUN: Would create workspace for user {} in {}'.format(
+            request.get('UserName'), request.get('DirectoryId')))
+    for workspace in plan.migrations:
+        print('DRY RUN: Would migrate workspace {} of user {} to bundle {}'.format(
+            workspace.get('WorkSpaceId'), workspace.get('UserName'), workspace.get('BundleId')))
+    for bundle_id in plan.bundle_deletes:
+        print('DRY RUN: Would delete bundleid {}'.format(bundle_id))
+    for image_id in plan.image_deletes:
+        print('DRY RUN: Would delete imageid {}'.format(image_id))
+    print('DRY RUN: Plan for region {}: {}; estimated API calls: {}'.format(
+        plan.region, plan.counts(), plan.estimate_api_calls()))
+
+
+def summarize_plan(plan):
+    '''
+    The per-region summary of a dry run
+    '''
+    return {'dry_run': True, 'planned': plan.counts(), 'api_calls': plan.estimate_api_calls()}
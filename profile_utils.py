@@ -0,0 +1,135 @@
+"""
+Opt-in profiling of a lambda function run, enabled by the WORKSPACE_PROFILE environment variable:
+"log" prints a compact report, any other value is a directory (e.g. /tmp) to write it to
+"""
+
+import cProfile
+import functools
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+
+import metrics_utils as metrics
+
+PROFILE_ENV = 'WORKSPACE_PROFILE'
+PROCESS_WIDE_PROFILER = sys.version_info >= (3, 12)
+PROFILE_TOP = 15
+TRACEMALLOC_FRAMES = 1
+
+
+class RunProfile():
+    '''
+    cProfile stats of the calling thread and every thread it starts, tracemalloc peak and top
+    allocations, and the wall time split between CPU and waiting
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.profiles = []
+        self.started = None
+        self.cpu_started = None
+        self.wall = 0
+        self.cpu = 0
+        self.peak = 0
+        self.allocations = []
+        self.api_ms = 0
+
+    def profile_thread(self, frame, event, arg):  # pylint: disable=unused-argument
+        '''
+        threading.setprofile hook before Python 3.12: give each new thread, e.g. a region worker,
+        its own profiler. A profiler that cannot be enabled leaves the thread unprofiled
+        '''
+        sys.setprofile(None)
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            return
+        with self.lock:
+            self.profiles.append(profile)
+
+    def start(self):
+        '''
+        Start profiling the calling thread and the threads started from now on
+        '''
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+        self.started = time.perf_counter()
+        self.cpu_started = time.process_time()
+        # from Python 3.12 cProfile uses sys.monitoring: one profiler covers every thread,
+        # and a second one cannot be enabled
+        if not PROCESS_WIDE_PROFILER:
+            threading.setprofile(self.profile_thread)
+        profile = cProfile.Profile()
+        self.profiles.append(profile)
+        profile.enable()
+
+    def stop(self):
+        '''
+        Stop profiling and collect the results
+        '''
+        self.profiles[0].disable()
+        if not PROCESS_WIDE_PROFILER:
+            threading.setprofile(None)
+        self.wall = time.perf_counter() - self.started
+        self.cpu = time.process_time() - self.cpu_started
+        self.peak = tracemalloc.get_traced_memory()[1]
+        self.allocations = tracemalloc.take_snapshot().statistics('lineno')[:PROFILE_TOP]
+        tracemalloc.stop()
+        # calls recorded by the instrumented clients, summed across threads
+        self.api_ms = sum(i.total_ms for i in metrics.snapshot().values())
+
+    def report(self, function_name):
+        '''
+        The compact text report of the run
+        '''
+        output = io.StringIO()
+        output.write('Profile of {}: wall {:.3f}s, cpu {:.3f}s, waiting {:.3f}s, '
+                     'API calls {:.3f}s across threads, tracemalloc peak {:.1f} MiB\n'.format(
+                         function_name, self.wall, self.cpu, max(self.wall - self.cpu, 0),
+                         self.api_ms / 1000, self.peak / 2 ** 20))
+        stats = pstats.Stats(self.profiles[0], stream=output)
+        for profile in self.profiles[1:]:
+            stats.add(profile)
+        stats.sort_stats('cumulative').print_stats(PROFILE_TOP)
+        output.write('Top allocations:\n')
+        for statistic in self.allocations:
+            output.write('{}\n'.format(statistic))
+        return output.getvalue()
+
+
+def profiled(function_name):
+    '''
+    Decorate a handler so that it is profiled whenever WORKSPACE_PROFILE is set.
+    Apply it inside metrics_utils.emitted, so the API call time is read before it is emitted
+    '''
+    def decorate(handler):
+        @functools.wraps(handler)
+        def wrapper(*args, **kwargs):
+            target = os.environ.get(PROFILE_ENV)
+            if not target:
+                return handler(*args, **kwargs)
+            run_profile = RunProfile()
+            run_profile.start()
+            try:
+                return handler(*args, **kwargs)
+            finally:
+                run_profile.stop()
+                write_report(target, function_name, run_profile.report(function_name))
+        return wrapper
+    return decorate
+
+
+def write_report(target, function_name, report):
+    '''
+    Print the report when target is "log", otherwise write it to a file in the target directory
+    '''
+    if target == 'log':
+        print(report)
+        return
+    file_name = os.path.join(target, '{}-profile-{}.txt'.format(function_name, int(time.time())))
+    with open(file_name, 'w') as report_file:
+        report_file.write(report)
+    print('Info: Profile written to {}'.format(file_name))
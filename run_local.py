@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+"""
+Runs a lambda function locally against fake_workspaces.py, optionally profiled
+e.g. python run_local.py refresh --workspaces 20000 --latency 0.05 --profile log
+Not packaged with the lambda functions.
+
+   Copyright 2021 Zulily, Inc.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+     http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import tempfile
+from unittest import mock
+
+import aws_client_utils as aws_client
+import common_utils as utils
+import fake_workspaces
+import profile_utils as profile
+import workspacecleanup
+import workspacer
+import workspacerefresh
+import workspacesync
+
+HANDLERS = {'maker': workspacer,
+            'refresh': workspacerefresh,
+            'cleanup': workspacecleanup,
+            'sync': workspacesync}
+
+
+def build_backend(args):
+    '''
+    A fake backend for each region, seeded with a synthetic fleet or a recorded inventory
+    '''
+    backend = fake_workspaces.FakeWorkSpacesBackend(args.latency, args.throttle_rate, args.seed)
+    recorded = utils.load_state_json(args.inventory) if args.inventory else {}
+    for region in args.regions:
+        if args.inventory:
+            backend.region(region).seed_inventory(recorded.get(region, {}))
+        else:
+            backend.region(region).seed_fleet(workspaces=args.workspaces)
+
+    return backend
+
+
+def fake_config(regions):
+    '''
+    A configuration matching the fleet fake_workspaces seeds
+    '''
+    return {'secret_info': {'region': regions[0], 'suffix': 'local', 'key': 'token'},
+            'gitlab_url': 'https://gitlab.invalid',
+            'team_workspaces': {team: {'Tags': [{'Key': 'team', 'Value': team}]}
+                                for team in fake_workspaces.DEFAULT_TEAMS},
+            'directory_suffixes': fake_workspaces.DEFAULT_SUFFIXES,
+            'directory_suffixes_non_encrypted': [],
+            'supported_prefix': fake_workspaces.DEFAULT_PREFIX,
+            'supported_regions': regions}
+
+
+def local_requests(users_file):
+    '''
+    A replacement for workspacer.get_requests reading the user JSON from a local file
+    '''
+    def get_requests(config):  # pylint: disable=unused-argument
+        with open(users_file, 'r') as user_file:
+            ws_list = json.load(user_file)
+        return {'requested': ws_list, 'users': ws_list, 'commit_id': None,
+                'sweep_due': False, 'snapshot': {}}
+
+    return get_requests
+
+
+def parse_args(argv=None):
+    '''
+    Parse the command line
+    '''
+    parser = argparse.ArgumentParser(description='Run a lambda function against fake WorkSpaces')
+    parser.add_argument('function', choices=sorted(HANDLERS))
+    parser.add_argument('--config', help='configuration JSON (default: one matching the fake fleet)')
+    parser.add_argument('--users', default='sample_user.json',
+                        help='user JSON read instead of GitLab by maker and sync')
+    parser.add_argument('--inventory', help='seed the fake from a recorded inventory_file')
+    parser.add_argument('--regions', default='us-east-1', type=lambda i: i.split(','),
+                        help='comma separated regions to seed')
+    parser.add_argument('--workspaces', default=1000, type=int,
+                        help='synthetic workspaces per region')
+    parser.add_argument('--latency', default=0, type=float, help='seconds per fake API call')
+    parser.add_argument('--throttle-rate', default=0, type=float,
+                        help='fraction of fake API calls throttled')
+    parser.add_argument('--seed', default=0, type=int)
+    parser.add_argument('--dry-run', action='store_true')
+    parser.add_argument('--profile', help='"log" or a directory such as /tmp to write the profile to')
+
+    return parser.parse_args(argv)
+
+
+def run(args):
+    '''
+    Run the chosen handler against the fake backend, returning its summary and the fake's calls
+    '''
+    backend = build_backend(args)
+    handler = HANDLERS[args.function]
+    env = {profile.PROFILE_ENV: args.profile} if args.profile else {}
+    with contextlib.ExitStack() as stack:
+        config_file = args.config
+        if not config_file:
+            temp_dir = stack.enter_context(tempfile.TemporaryDirectory())
+            config_file = os.path.join(temp_dir, 'workspace_config.json')
+            utils.save_state_json(config_file, fake_config(args.regions))
+        stack.enter_context(mock.patch.object(handler, 'CONFIG_FILE', config_file))
+        stack.enter_context(mock.patch.object(workspacer, 'get_requests',
+                                              local_requests(args.users)))
+        stack.enter_context(mock.patch.dict(os.environ, env))
+        aws_client.set_client_factory(backend.client_factory)
+        stack.callback(aws_client.set_client_factory, None)
+        summary = handler.main({'dry_run': args.dry_run}, None)
+
+    return summary, backend.total_calls()
+
+
+def main(argv=None):
+    '''
+    main function: run a lambda function locally
+    '''
+    summary, calls = run(parse_args(argv))
+    print(json.dumps({'summary': summary, 'fake_api_calls': calls}, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+"""
+   Tests for aws_secret_utils.py
+   Called via nosetests test_aws_secret_utils.py
+"""
+
+# Global imports
+import unittest
+
+# Local imports
+import aws_secret_utils
+
+
+class CountingSecretsStub():
+    """
+    Stand-in for the boto secretsmanager client, counting calls
+    """
+    def __init__(self):
+        self.calls = 0
+
+    def get_secret_value(self, SecretId):  # pylint: disable=invalid-name
+        """
+        Return a JSON secret string
+        """
+        self.calls += 1
+        return {'SecretString': '{"token": "%s-%d"}' % (SecretId, self.calls)}
+
+
+class TestSecretsClient(unittest.TestCase):
+    """
+    Standard test class, for all SecretsClient functions
+    """
+
+    def test_get_aws_secret_value_cached(self):
+        """
+        Test that a secret is fetched once while within its ttl, and again after it expires
+        """
+        aws_secret_utils.SECRET_CACHE.clear()
+        stub = CountingSecretsStub()
+        client = aws_secret_utils.SecretsClient('us-east-1')
+        client.secrets_client = stub
+        self.assertEqual(client.get_aws_secret_value('maker', 'token'), 'maker-1')
+        self.assertEqual(client.get_aws_secret_value('maker', 'token'), 'maker-1')
+        self.assertEqual(stub.calls, 1)
+        expired = aws_secret_utils.SecretsClient('us-east-1', ttl=-1)
+        expired.secrets_client = stub
+        aws_secret_utils.SECRET_CACHE.clear()
+        self.assertEqual(expired.get_aws_secret_value('maker', 'token'), 'maker-2')
+        self.assertEqual(expired.get_aws_secret_value('maker', 'token'), 'maker-3')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+"""
+   Tests for aws_workspace_utils.py
+   Called via nosetests test_aws_workspace_utils.py
+"""
+
+# Global imports
+import threading
+import unittest
+from unittest import mock
+
+from botocore.exceptions import ClientError
+
+# Local imports
+import aws_workspace_utils
+import common_utils
+import plan_utils
+
+
+class PagedStub():
+    """
+    Minimal stand-in for the boto workspaces client, serving canned pages
+    """
+    def __init__(self, pages):
+        self.pages = pages
+        self.calls = []
+
+    def describe_workspaces(self, **kwargs):
+        """
+        Return the page addressed by NextToken
+        """
+        self.calls.append(kwargs)
+        index = int(kwargs.get('NextToken', 0))
+        response = {'Workspaces': self.pages[index]}
+        if index + 1 < len(self.pages):
+            response['NextToken'] = str(index + 1)
+        return response
+
+
+class ThrottlingTagStub():
+    """
+    Stand-in for describe_tags that throttles the first call for each resource
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.seen = set()
+
+    def describe_tags(self, ResourceId):  # pylint: disable=invalid-name
+        """
+        Throttle once per ResourceId, then return a team tag
+        """
+        with self.lock:
+            first = ResourceId not in self.seen
+            self.seen.add(ResourceId)
+        if ResourceId == 'ws-gone':
+            raise ClientError({'Error': {'Code': 'ResourceNotFoundException'}}, 'DescribeTags')
+        if first:
+            raise ClientError({'Error': {'Code': 'ThrottlingException'}}, 'DescribeTags')
+        return {'TagList': [{'Key': 'team', 'Value': ResourceId.upper()}]}
+
+
+class ThrottlingMigrateStub():
+    """
+    Stand-in for migrate_workspace that throttles its first call
+    """
+    def __init__(self):
+        self.calls = 0
+
+    def migrate_workspace(self, SourceWorkspaceId, BundleId):  # pylint: disable=invalid-name,unused-argument
+        """
+        Throttle the first call, then accept the migration
+        """
+        self.calls += 1
+        if self.calls == 1:
+            raise ClientError({'Error': {'Code': 'ThrottlingException'}}, 'MigrateWorkspace')
+        return {}
+
+
+class FlakyCreateStub():
+    """
+    Stand-in for create_workspaces that fails the given users on their first submission,
+    and the existing users on every submission
+    """
+    def __init__(self, flaky_users, existing_users=()):
+        self.flaky_users = set(flaky_users)
+        self.existing_users = set(existing_users)
+        self.batch_sizes = []
+
+    def create_workspaces(self, Workspaces):  # pylint: disable=invalid-name
+        """
+        Accept every request except a first attempt for a flaky user
+        """
+        self.batch_sizes.append(len(Workspaces))
+        response = {'PendingRequests': [], 'FailedRequests': []}
+        for request in Workspaces:
+            if request['UserName'] in self.existing_users:
+                response['FailedRequests'].append({'WorkspaceRequest': request,
+                                                   'ErrorCode': 'ResourceExists.WorkSpace'})
+            elif request['UserName'] in self.flaky_users:
+                self.flaky_users.remove(request['UserName'])
+                response['FailedRequests'].append({'WorkspaceRequest': request,
+                                                   'ErrorCode': 'ResourceLimitExceeded'})
+            else:
+                response['PendingRequests'].append(dict(request, WorkspaceId='ws-' + request['UserName']))
+        return response
+
+
+class TestWorkSpaceClient(unittest.TestCase):
+    """
+    Standard test class, for all WorkSpaceClient functions
+    """
+
+    def setUp(self):
+        aws_workspace_utils.RATE_LIMITERS.clear()
+        self.addCleanup(aws_workspace_utils.RATE_LIMITERS.clear)
+
+    def test_get_current_workspaces_paginated(self):
+        """
+        Test that every page is followed and collected
+        """
+        client = aws_workspace_utils.WorkSpaceClient('us-east-1')
+        client.ws_client = PagedStub([[{'WorkspaceId': 'ws-1'}],
+                                      [{'WorkspaceId': 'ws-2'}],
+                                      [{'WorkspaceId': 'ws-3'}]])
+        workspaces = client.get_current_workspaces()
+        self.assertEqual([i.WorkspaceId for i in workspaces], ['ws-1', 'ws-2', 'ws-3'])
+        self.assertEqual(client.ws_client.calls, [{}, {'NextToken': '1'}, {'NextToken': '2'}])
+
+    def test_records(self):
+        """
+        Test that records keep only their fields and answer dict-style get()
+        """
+        workspace = aws_workspace_utils.Workspace.from_boto(
+            {'WorkspaceId': 'ws-1', 'UserName': 'user', 'DirectoryId': 'd-1',
+             'WorkspaceProperties': {'RunningMode': 'AUTO_STOP'}})
+        self.assertEqual(workspace.get('UserName'), 'user')
+        self.assertIsNone(workspace.get('BundleId'))
+        self.assertEqual(workspace.get('WorkspaceProperties', {}), {})
+        self.assertEqual(workspace.get('count', 0), 0)
+        self.assertFalse(hasattr(workspace, '__dict__'))
+
+    def test_iter_workspace_pages_lazy(self):
+        """
+        Test that pages are only requested as they are consumed
+        """
+        client = aws_workspace_utils.WorkSpaceClient('us-east-1')
+        client.ws_client = PagedStub([[{'WorkspaceId': 'ws-1'}], [{'WorkspaceId': 'ws-2'}]])
+        pages = client.iter_workspace_pages()
+        self.assertEqual(next(pages), [{'WorkspaceId': 'ws-1'}])
+        self.assertEqual(len(client.ws_client.calls), 1)
+
+    def test_get_tags_bulk(self):
+        """
+        Test that tags are fetched for every id, retrying throttled calls and
+        mapping ids whose tags cannot be read to None
+        """
+        client = aws_workspace_utils.WorkSpaceClient('us-east-1')
+        client.ws_client = ThrottlingTagStub()
+        resource_ids = ['ws-{}'.format(i) for i in range(20)] + ['ws-gone']
+        # the stub throttles regardless of rate, so keep the limiter from slowing the test down
+        limiter = common_utils.AdaptiveRateLimiter(min_rate=1000)
+        with mock.patch.object(aws_workspace_utils, 'BACKOFF_BASE_SECONDS', 0.001), \
+             mock.patch.object(aws_workspace_utils, 'get_rate_limiter', return_value=limiter):
+            tag_map = client.get_tags_bulk(resource_ids, max_workers=4)
+        self.assertEqual(len(tag_map), 21)
+        self.assertEqual(tag_map['ws-7'], [{'Key': 'team', 'Value': 'WS-7'}])
+        self.assertIsNone(tag_map['ws-gone'])
+        self.assertEqual(client.get_tags_bulk([]), {})
+        self.assertEqual(limiter.rate, 1000)
+
+    def test_rate_limiter_shared(self):
+        """
+        Test that a throttle engages the limiter of its region and operation class only
+        """
+        client = aws_workspace_utils.WorkSpaceClient('us-east-1')
+        client.ws_client = ThrottlingTagStub()
+        with mock.patch.object(aws_workspace_utils, 'BACKOFF_BASE_SECONDS', 0.001):
+            client.get_tags('ws-1')
+        limiter = aws_workspace_utils.get_rate_limiter('us-east-1', 'describe_tags')
+        self.assertIsNotNone(limiter.rate)
+        self.assertIsNone(aws_workspace_utils.get_rate_limiter('us-east-1',
+                                                               'describe_workspaces').rate)
+        self.assertIs(aws_workspace_utils.get_rate_limiter('us-east-1', 'delete_workspace_bundle'),
+                      aws_workspace_utils.get_rate_limiter('us-east-1', 'delete_workspace_image'))
+        self.assertIsNone(aws_workspace_utils.get_rate_limiter('us-east-1', 'migrate_workspace').rate)
+        self.assertIsNone(aws_workspace_utils.get_rate_limiter('eu-west-1', 'describe_tags').rate)
+
+    def test_single_calls_paced(self):
+        """
+        Test that single-resource calls go through the shared limiter and backoff too
+        """
+        client = aws_workspace_utils.WorkSpaceClient('us-east-1')
+        client.ws_client = ThrottlingMigrateStub()
+        with mock.patch.object(aws_workspace_utils, 'BACKOFF_BASE_SECONDS', 0.001):
+            self.assertEqual(client.migrate_workspace('ws-1', 'wsb-1'), {})
+        self.assertEqual(client.ws_client.calls, 2)
+        self.assertIsNotNone(
+            aws_workspace_utils.get_rate_limiter('us-east-1', 'migrate_workspace').rate)
+
+    def test_pool_connections(self):
+        """
+        Test that the connection pool grows with the configured concurrency
+        """
+        client = plan_utils.new_client('us-east-1', {'migration_concurrency': 32})
+        self.assertEqual(client.ws_client.client.meta.config.max_pool_connections, 32)
+        client = plan_utils.new_client('us-east-1', {})
+        self.assertEqual(client.ws_client.client.meta.config.max_pool_connections,
+                         aws_workspace_utils.POOL_CONNECTIONS)
+
+    def test_single_retry_layer(self):
+        """
+        Test that boto clients make one attempt and the backoff loop retries server errors
+        without cutting the rate
+        """
+        client = aws_workspace_utils.WorkSpaceClient('us-east-1')
+        self.assertEqual(client.ws_client.client.meta.config.retries['total_max_attempts'], 1)
+        responses = [ClientError({'Error': {'Code': 'InternalServerError'},
+                                  'ResponseMetadata': {'HTTPStatusCode': 500}}, 'DescribeTags'),
+                     {'TagList': []}]
+
+        def describe_tags(ResourceId):  # pylint: disable=invalid-name,unused-argument
+            response = responses.pop(0)
+            if isinstance(response, Exception):
+                raise response
+            return response
+
+        limiter = common_utils.AdaptiveRateLimiter()
+        with mock.patch.object(aws_workspace_utils, 'BACKOFF_BASE_SECONDS', 0.001):
+            self.assertEqual(aws_workspace_utils.call_with_backoff(describe_tags, limiter,
+                                                                   ResourceId='ws-1'),
+                             {'TagList': []})
+        self.assertIsNone(limiter.rate)
+
+    def test_create_workspaces_batched(self):
+        """
+        Test that requests are chunked and only transient failures are resubmitted
+        """
+        client = aws_workspace_utils.WorkSpaceClient('us-east-1')
+        client.ws_client = FlakyCreateStub(['user3', 'user40'], ['user7'])
+        configs = [{'UserName': 'user{}'.format(i), 'DirectoryId': 'd-1'} for i in range(60)]
+        with mock.patch.object(aws_workspace_utils, 'BACKOFF_BASE_SECONDS', 0.001):
+            pending, failed = client.create_workspaces(configs)
+        self.assertEqual(client.ws_client.batch_sizes, [25, 25, 10, 2])
+        self.assertEqual(len(pending), 59)
+        self.assertEqual([i['ErrorCode'] for i in failed], ['ResourceExists.WorkSpace'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,7 +5,11 @@
 """
 
 # Global imports
+import os
+import tempfile
+import time
 import unittest
+from unittest import mock
 
 # Local imports
 import common_utils
@@ -27,6 +31,24 @@ class TestCommonUtils(unittest.TestCase):
         self.assertGreaterEqual(len(config_info['secret_info']), 3)
 
 
+    def test_load_config_json_cached(self):
+        """
+        Test that cached config is isolated from callers and reloaded when the file changes
+        """
+        with tempfile.TemporaryDirectory() as temp_dir:
+            config_file = os.path.join(temp_dir, 'config.json')
+            with open(config_file, 'w') as deffile:
+                deffile.write('{"supported_regions": ["us-east-1"]}')
+            config_info = common_utils.load_config_json(config_file)
+            config_info['supported_regions'].append('eu-west-1')
+            self.assertEqual(common_utils.load_config_json(config_file),
+                             {'supported_regions': ['us-east-1']})
+            with open(config_file, 'w') as deffile:
+                deffile.write('{"supported_regions": ["ca-central-1"]}')
+            self.assertEqual(common_utils.load_config_json(config_file),
+                             {'supported_regions': ['ca-central-1']})
+
+
     def test_determine_team_bundle_id(self):
         """
         Test the method that returns the correct bundle_id
@@ -46,5 +68,95 @@ class TestCommonUtils(unittest.TestCase):
         bundle_id = common_utils.determine_team_bundle_id(test_bundles, 'notest')
         self.assertEqual(bundle_id, None)
 
+    def test_bundle_index(self):
+        """
+        Test the single-pass bundle index, including names without a patch date
+        """
+        test_bundles = {'image_win10_power_20210801_test': {'BundleId': 'abc-123123123'},
+                        'image_win10_power_20210803_test': {'BundleId': 'abc-123123124'},
+                        'image_win10_power_20210805': {'BundleId': 'abc-123123125'},
+                        'Standard with Windows 10': {'BundleId': 'abc-000000000'}}
+        bundle_index = common_utils.BundleIndex(test_bundles)
+        self.assertEqual(bundle_index.latest_bundle_id('test'), 'abc-123123124')
+        self.assertEqual(bundle_index.latest_bundle_id('default'), 'abc-123123125')
+        self.assertEqual(common_utils.BundleIndex({}).latest_bundle_id('test'), None)
+
+    def test_state_json(self):
+        """
+        Test that state persisted between runs round-trips, and is empty when missing
+        """
+        with tempfile.TemporaryDirectory() as temp_dir:
+            state_file = os.path.join(temp_dir, 'state.json')
+            self.assertEqual(common_utils.load_state_json(state_file), {})
+            common_utils.save_state_json(state_file, {'commit_id': 'abc123'})
+            self.assertEqual(common_utils.load_state_json(state_file), {'commit_id': 'abc123'})
+
+    def test_rate_limiter(self):
+        """
+        Test that the token bucket paces acquisitions after the initial burst
+        """
+        limiter = common_utils.RateLimiter(50, burst=2)
+        start = time.monotonic()
+        for _ in range(7):
+            limiter.acquire()
+        self.assertGreaterEqual(time.monotonic() - start, 0.09)
+        common_utils.RateLimiter(None).acquire()
+
+    def test_adaptive_rate_limiter(self):
+        """
+        Test that throttles cut the rate multiplicatively, once per second, and successes raise it
+        """
+        limiter = common_utils.AdaptiveRateLimiter(min_rate=1, increase=2, decrease=0.5)
+        for _ in range(40):
+            limiter.acquire()
+        self.assertIsNone(limiter.rate)
+        limiter.on_throttle()
+        first = limiter.rate
+        self.assertGreaterEqual(first, 20)
+        limiter.on_throttle()
+        self.assertEqual(limiter.rate, first)
+        with mock.patch.object(time, 'monotonic', return_value=time.monotonic() + 1.5):
+            limiter.on_throttle()
+            self.assertAlmostEqual(limiter.rate, first / 2)
+        with mock.patch.object(time, 'monotonic', return_value=time.monotonic() + 3.5):
+            limiter.on_success()
+            self.assertAlmostEqual(limiter.rate, first / 2 + 4, places=2)
+
+    def test_adaptive_rate_limiter_keeps_cutting(self):
+        """
+        Test that successes between throttles do not stop the throttles from cutting the rate
+        """
+        clock = [1000.0]
+        limiter = common_utils.AdaptiveRateLimiter(min_rate=1, increase=1, decrease=0.5)
+        with mock.patch.object(time, 'monotonic', side_effect=lambda: clock[0]):
+            # ten calls within the shortest window, then a throttle: the rate drops to 50
+            for _ in range(10):
+                limiter.acquire()
+            limiter.on_throttle()
+            self.assertEqual(limiter.rate, 50)
+            # half the calls throttled for 30 seconds, at 100 calls per second
+            for _ in range(1500):
+                clock[0] += 0.01
+                limiter.on_success()
+                clock[0] += 0.01
+                limiter.on_throttle()
+        self.assertLess(limiter.rate, 2)
+
+    def test_run_regions(self):
+        """
+        Test that every region is run and a failing region is isolated
+        """
+        def region_func(region):
+            if region == 'bad-region':
+                raise RuntimeError('boom')
+            return {'created': len(region)}
+
+        summary = common_utils.run_regions(['us-east-1', 'bad-region', 'eu-west-1'],
+                                           region_func, max_workers=2)
+        self.assertEqual(summary['us-east-1'], {'status': 'ok', 'created': 9})
+        self.assertEqual(summary['bad-region']['status'], 'error')
+        self.assertEqual(summary['eu-west-1']['status'], 'ok')
+        self.assertEqual(common_utils.run_regions([], region_func), {})
+
 if __name__ == '__main__':
     unittest.main()
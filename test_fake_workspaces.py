@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+"""
+   Tests running the lambda functions against fake_workspaces.py
+   Called via nosetests test_fake_workspaces.py
+"""
+
+# Global imports
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import botocore
+
+# Local imports
+import aws_client_utils
+import aws_workspace_utils
+import common_utils
+import fake_workspaces
+import inventory_utils
+import plan_utils
+import run_local
+import workspacecleanup
+import workspacer
+import workspacerefresh
+import workspacesync
+
+REGION = 'us-east-1'
+CONFIG = {'team_workspaces': {team: {'Tags': [{'Key': 'team', 'Value': team}]}
+                              for team in fake_workspaces.DEFAULT_TEAMS},
+          'directory_suffixes': fake_workspaces.DEFAULT_SUFFIXES,
+          'directory_suffixes_non_encrypted': [],
+          'supported_prefix': fake_workspaces.DEFAULT_PREFIX}
+
+
+class TestFakeWorkSpaces(unittest.TestCase):
+    """
+    Drive each lambda's region processing against a seeded fake fleet
+    """
+
+    def setUp(self):
+        self.backend = fake_workspaces.FakeWorkSpacesBackend(seed=1)
+        self.fake = self.backend.region(REGION)
+        self.fake.seed_fleet(workspaces=300)
+        aws_client_utils.set_client_factory(self.backend.client_factory)
+        aws_workspace_utils.RATE_LIMITERS.clear()
+        self.addCleanup(aws_workspace_utils.RATE_LIMITERS.clear)
+
+    def tearDown(self):
+        aws_client_utils.set_client_factory(None)
+
+    def test_pagination(self):
+        """
+        Test that the client sees the whole fleet across fake pages
+        """
+        client = aws_workspace_utils.WorkSpaceClient(REGION)
+        self.assertEqual(len(client.get_current_workspaces()), 300)
+        self.assertGreater(self.fake.calls['DescribeWorkspaces'], 1)
+
+    def test_directory_filter(self):
+        """
+        Test that listing by managed directory leaves out other teams' workspaces
+        """
+        client = aws_workspace_utils.WorkSpaceClient(REGION)
+        directory_ids = common_utils.get_directory_ids(REGION, CONFIG['directory_suffixes'],
+                                                       client.get_current_directories())
+        managed = client.get_current_workspaces(directory_ids)
+        self.assertEqual(sorted(i.WorkspaceId for i in managed),
+                         sorted(i['WorkspaceId'] for i in self.fake.workspaces.values()
+                                if i['DirectoryId'] in directory_ids))
+        self.assertLess(len(managed), 300)
+        self.assertEqual(client.get_current_workspaces([]), [])
+
+    def test_maker(self):
+        """
+        Test that only users missing from their directory are created
+        """
+        ws_list = [{'UserName': 'user000001', 'Directory': 'admin', 'Region': REGION,
+                    'Team': 'backend'},
+                   {'UserName': 'newuser', 'Directory': 'production', 'Region': REGION,
+                    'Team': 'data'},
+                   {'UserName': 'lostuser', 'Directory': 'missing', 'Region': REGION,
+                    'Team': 'data'}]
+        summary = workspacer.process_region(CONFIG, ws_list, REGION)
+        self.assertEqual(summary, {'created': 1, 'failed': 0, 'unprocessed': 1})
+        self.assertEqual(len(self.fake.workspaces), 301)
+
+    def test_maker_progress(self):
+        """
+        Test that the user file commit is not recorded while a request could not be planned
+        """
+        ws_list = [{'UserName': 'lostuser', 'Directory': 'missing', 'Region': REGION,
+                    'Team': 'data'}]
+        user_requests = {'requested': ws_list, 'users': ws_list, 'commit_id': 'abc',
+                         'sweep_due': False, 'snapshot': {}}
+        with tempfile.TemporaryDirectory() as temp_dir:
+            config = dict(CONFIG, gitlab_cache_file=os.path.join(temp_dir, 'cache.json'))
+            config_file = os.path.join(temp_dir, 'workspace_config.json')
+            common_utils.save_state_json(config_file, config)
+            with mock.patch.object(workspacer, 'CONFIG_FILE', config_file), \
+                 mock.patch.object(workspacer, 'get_requests', return_value=user_requests):
+                summary = workspacer.main({}, None)
+            self.assertEqual(summary[REGION]['unprocessed'], 1)
+            self.assertEqual(common_utils.load_state_json(config['gitlab_cache_file']), {})
+
+    def test_refresh_then_cleanup(self):
+        """
+        Test that refresh migrates stale workspaces and cleanup then removes old bundles
+        """
+        summary = workspacerefresh.process_region(CONFIG, REGION)
+        self.assertGreater(summary['migrated'], 0)
+        self.assertEqual(workspacerefresh.process_region(CONFIG, REGION)['migrated'], 0)
+        bundles = len(self.fake.bundles)
+        summary = workspacecleanup.process_region(CONFIG, REGION)
+        self.assertGreater(summary['bundles_deleted'], 0)
+        self.assertEqual(len(self.fake.bundles), bundles - summary['bundles_deleted'])
+        self.assertEqual(workspacecleanup.process_region(CONFIG, REGION)['bundles_deleted'], 0)
+
+    def test_delete_bundles_and_images(self):
+        """
+        Test that throttled deletes are retried and an image waits for its bundle
+        """
+        backend = fake_workspaces.FakeWorkSpacesBackend(throttle_rate=0.3, seed=2)
+        fake = backend.region(REGION)
+        free_bundle = fake.add_bundle('zara_win10_20210101')
+        used_bundle = fake.add_bundle('zara_win10_20210102')
+        fake.add_workspace('someone', fake.add_directory('us-east-1-test'), used_bundle)
+        orphan = fake.add_image('zara_orphan')
+        image_bundles = {fake.bundles[i]['ImageId']: [i] for i in (free_bundle, used_bundle)}
+        client = aws_workspace_utils.WorkSpaceClient(REGION, client_factory=backend.client_factory)
+        with mock.patch.object(aws_workspace_utils, 'BACKOFF_BASE_SECONDS', 0.001):
+            report = client.delete_bundles_and_images([free_bundle, used_bundle],
+                                                      list(image_bundles) + [orphan],
+                                                      image_bundles)
+        self.assertTrue(report[free_bundle]['Success'])
+        self.assertEqual(report[used_bundle]['Error'], 'ResourceAssociatedException')
+        self.assertEqual(report[fake.bundles[used_bundle]['ImageId']]['Error'],
+                         'BundleDeleteFailed')
+        self.assertTrue(report[orphan]['Success'])
+        self.assertEqual(set(fake.images), {fake.bundles[used_bundle]['ImageId']})
+
+    def test_refresh_budget(self):
+        """
+        Test that a migration budget rolls forward across runs using the cursor
+        """
+        config = dict(CONFIG, max_migrations_per_run=40)
+        first = workspacerefresh.process_region(config, REGION)
+        self.assertEqual(first['migrated'], 40)
+        self.assertIsNotNone(first['cursor'])
+        second = workspacerefresh.process_region(config, REGION, first['cursor'])
+        self.assertEqual(second['out_of_date'], first['out_of_date'] - 40)
+
+    def test_dry_run(self):
+        """
+        Test that a dry run plans and estimates without changing the fleet
+        """
+        summary = workspacerefresh.process_region(CONFIG, REGION, dry_run=True)
+        self.assertTrue(summary['dry_run'])
+        self.assertGreater(summary['planned']['migrations'], 0)
+        self.assertEqual(summary['api_calls']['MigrateWorkspace'],
+                         summary['planned']['migrations'])
+        summary = workspacecleanup.process_region(CONFIG, REGION, dry_run=True)
+        self.assertGreater(summary['api_calls']['DeleteWorkspaceBundle'], 0)
+        self.assertEqual(self.fake.calls['MigrateWorkspace'] +
+                         self.fake.calls['DeleteWorkspaceBundle'], 0)
+
+    def test_sync(self):
+        """
+        Test that the single-pass handler lists the region once and does all three jobs
+        """
+        ws_list = [{'UserName': 'newuser', 'Directory': 'production', 'Region': REGION,
+                    'Team': 'data'}]
+        summary = workspacesync.process_region(CONFIG, REGION, ws_list)
+        self.assertEqual(summary['created'], 1)
+        self.assertGreater(summary['migrated'], 0)
+        self.assertGreater(summary['bundles_deleted'], 0)
+        self.assertEqual(self.fake.calls['DescribeWorkspaces'],
+                         -(-300 // fake_workspaces.PAGE_SIZE))
+
+    def test_sync_progress(self):
+        """
+        Test that the user file commit is only recorded once every region created its users,
+        and that an unreadable user file still refreshes and cleans up
+        """
+        ws_list = [{'UserName': 'newuser', 'Directory': 'production', 'Region': REGION,
+                    'Team': 'data'}]
+        user_requests = {'requested': ws_list, 'users': ws_list, 'commit_id': 'abc',
+                         'sweep_due': False, 'snapshot': {}}
+        with tempfile.TemporaryDirectory() as temp_dir:
+            config = dict(CONFIG, supported_regions=[REGION],
+                          gitlab_cache_file=os.path.join(temp_dir, 'cache.json'))
+            config_file = os.path.join(temp_dir, 'workspace_config.json')
+            common_utils.save_state_json(config_file, config)
+            unreachable = botocore.exceptions.SSLError(endpoint_url='https://workspaces',
+                                                       error='handshake failed')
+            with mock.patch.object(workspacesync, 'CONFIG_FILE', config_file), \
+                 mock.patch.object(workspacer, 'get_requests', return_value=user_requests), \
+                 mock.patch.object(plan_utils, 'new_snapshot', side_effect=unreachable):
+                summary = workspacesync.main({}, None)
+            self.assertEqual(summary[REGION]['skipped'], 'unreachable')
+            self.assertEqual(common_utils.load_state_json(config['gitlab_cache_file']), {})
+
+            with mock.patch.object(workspacesync, 'CONFIG_FILE', config_file), \
+                 mock.patch.object(workspacer, 'get_requests', side_effect=SystemExit(1)):
+                summary = workspacesync.main({}, None)
+            self.assertGreater(summary[REGION]['migrated'], 0)
+            self.assertEqual(summary[REGION]['created'], 0)
+            self.assertEqual(common_utils.load_state_json(config['gitlab_cache_file']), {})
+
+    def test_inventory_store(self):
+        """
+        Test that a second run reads bundles from the store and only looks up new tags
+        """
+        self.addCleanup(inventory_utils.STORE_CACHE.clear)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            config = dict(CONFIG, inventory_file=os.path.join(temp_dir, 'inventory.json'))
+            first = workspacerefresh.process_region(config, REGION)
+            tag_calls = self.fake.calls['DescribeTags']
+            inventory_utils.save_store(config)
+            workspacerefresh.process_region(config, REGION)
+            self.assertEqual(self.fake.calls['DescribeWorkspaceBundles'], 1)
+            self.assertEqual(self.fake.calls['DescribeTags'] - tag_calls, first['migrated'])
+
+    def test_recorded_inventory(self):
+        """
+        Test that a fake seeded from a recorded inventory plans the same cleanup
+        """
+        self.addCleanup(inventory_utils.STORE_CACHE.clear)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            config = dict(CONFIG, inventory_file=os.path.join(temp_dir, 'inventory.json'),
+                          supported_regions=[REGION])
+            planned = workspacecleanup.process_region(config, REGION, dry_run=True)
+            inventory_utils.save_store(config)
+            recorded = common_utils.load_state_json(config['inventory_file'])
+        replay = fake_workspaces.FakeWorkSpacesBackend().region(REGION)
+        replay.seed_inventory(recorded[REGION])
+        self.assertEqual(len(replay.workspaces), 300)
+        client = aws_workspace_utils.WorkSpaceClient(REGION, lambda *_: replay)
+        snapshot = plan_utils.RegionSnapshot(client, REGION, CONFIG['directory_suffixes'])
+        self.assertEqual(workspacecleanup.plan_region(config, snapshot).counts(),
+                         planned['planned'])
+
+    def test_run_local(self):
+        """
+        Test that the local runner drives a handler against its own fake fleet
+        """
+        with contextlib.redirect_stdout(io.StringIO()):
+            summary, calls = run_local.run(run_local.parse_args(
+                ['sync', '--workspaces', '50', '--dry-run']))
+        self.assertTrue(summary[REGION]['dry_run'])
+        self.assertEqual(calls['MigrateWorkspace'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+"""
+   Tests for gitlab_utils.py
+   Called via nosetests test_gitlab_utils.py
+"""
+
+# Global imports
+import json
+import threading
+import unittest
+import urllib.parse
+
+# Local imports
+import gitlab_utils
+import metrics_utils
+
+BASE_URL = 'https://gitlab.sample.com'
+
+
+class FakeResponse():
+    """
+    Minimal stand-in for requests.Response
+    """
+    def __init__(self, url, body, links=None, headers=None):
+        self.url = url
+        self.text = json.dumps(body)
+        self.links = links or {}
+        self.headers = headers or {}
+        self.status_code = 200
+        self.ok = True
+
+    def json(self):
+        """
+        Decode the body
+        """
+        return json.loads(self.text)
+
+    def raise_for_status(self):
+        """
+        Fake responses never fail
+        """
+
+
+class FakeSession():
+    """
+    Serves numbered pages of a collection, with or without X-Total-Pages
+    """
+    def __init__(self, pages, total_pages=True):
+        self.pages = pages
+        self.total_pages = total_pages
+        self.lock = threading.Lock()
+        self.requested = []
+
+    def get(self, url, headers=None):
+        """
+        Return the page named by the page query parameter
+        """
+        query = dict(urllib.parse.parse_qsl(urllib.parse.urlsplit(url).query))
+        page = int(query.get('page', 1))
+        with self.lock:
+            self.requested.append(page)
+        links = {}
+        if page < len(self.pages):
+            links['next'] = {'url': gitlab_utils.set_page(url, page + 1)}
+        headers = {'X-Total-Pages': str(len(self.pages))} if self.total_pages else {}
+        return FakeResponse(url, self.pages[page - 1], links, headers)
+
+
+class FakeDoraSession():
+    """
+    Serves one day of each DORA metric per project
+    """
+    def get(self, url, headers=None):
+        """
+        Return yesterday's and today's value for the requested metric
+        """
+        query = dict(urllib.parse.parse_qsl(urllib.parse.urlsplit(url).query))
+        body = [{'date': '2021-08-01', 'value': 1}, {'date': query['start_date'], 'value': 2}]
+        return FakeResponse(url, body, headers={'RateLimit-Remaining': '100'})
+
+
+class TestGitLabClient(unittest.TestCase):
+    """
+    Standard test class, for all GitLabClient functions
+    """
+
+    def test_query_gitlab_paginated(self):
+        """
+        Test that every page is returned in order, with and without X-Total-Pages
+        """
+        pages = [[{'id': page * 10 + i} for i in range(3)] for page in range(7)]
+        expected = [record for page in pages for record in page]
+        for total_pages in (True, False):
+            client = gitlab_utils.GitLabClient(BASE_URL, 'token')
+            client.http = FakeSession(pages, total_pages)
+            self.assertEqual(client.get_group_projects('group/subgroup'), expected)
+            self.assertEqual(sorted(client.http.requested), list(range(1, 8)))
+
+    def test_iter_group_projects(self):
+        """
+        Test that records stream page by page and stopping early skips later pages
+        """
+        pages = [[{'id': page * 10 + i} for i in range(3)] for page in range(5)]
+        client = gitlab_utils.GitLabClient(BASE_URL, 'token')
+        client.http = FakeSession(pages)
+        self.assertEqual(len(list(client.iter_group_projects('group'))), 15)
+        client.http = FakeSession(pages)
+        first = next(i for i in client.iter_group_projects('group') if i['id'] == 11)
+        self.assertEqual(first, {'id': 11})
+        self.assertEqual(client.http.requested, [1, 2])
+
+    def test_get_dora_metrics_bulk(self):
+        """
+        Test that metrics for every project and metric are returned as a flat list
+        """
+        client = gitlab_utils.GitLabClient(BASE_URL, 'token')
+        client.http = FakeDoraSession()
+        projects = ['group/one', {'path_with_namespace': 'group/two'}, 'group/three']
+        metrics = client.get_dora_metrics_bulk(projects, 'production', '2021-08-02', max_workers=3)
+        self.assertEqual(len(metrics), len(projects) * len(gitlab_utils.DORA_METRIC_LIST))
+        self.assertEqual([i['project'] for i in metrics[:2]], ['group/one', 'group/one'])
+        self.assertEqual({i['date'] for i in metrics}, {'2021-08-02'})
+
+    def test_endpoint_metrics(self):
+        """
+        Test that calls are recorded per endpoint kind rather than per HTTP method
+        """
+        self.addCleanup(metrics_utils.METRICS.clear)
+        metrics_utils.METRICS.clear()
+        client = gitlab_utils.GitLabClient(BASE_URL, 'token')
+        client.http = FakeDoraSession()
+        client.get_dora_metrics_bulk(['group/one'], 'production', '2021-08-02', max_workers=1)
+        client.http = FakeSession([[{'id': 1}]])
+        client.get_group_projects('group')
+        operations = {key[1] for key in metrics_utils.snapshot()}
+        self.assertEqual(operations, {'dora/metrics', 'projects'})
+        self.assertEqual(gitlab_utils.endpoint_kind(
+            BASE_URL + '/api/v4/projects/1/repository/files/users.json?ref=main'), 'files')
+        self.assertEqual(gitlab_utils.endpoint_kind(BASE_URL + '/-/liveness'), 'liveness')
+
+    def test_respect_rate_limit(self):
+        """
+        Test that an exhausted rate limit pauses later requests
+        """
+        client = gitlab_utils.GitLabClient(BASE_URL, 'token')
+        client.respect_rate_limit(FakeResponse(BASE_URL, [], headers={'RateLimit-Remaining': '50'}))
+        self.assertEqual(client.resume_at, 0)
+        client.respect_rate_limit(FakeResponse(BASE_URL, [], headers={'Retry-After': '5'}))
+        self.assertGreater(client.resume_at, 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+"""
+   Tests for inventory_utils.py
+   Called via nosetests test_inventory_utils.py
+"""
+
+# Global imports
+import datetime
+import os
+import tempfile
+import time
+import unittest
+
+# Local imports
+import inventory_utils
+
+
+class TestInventoryStore(unittest.TestCase):
+    """
+    Standard test class, for all inventory_utils functions
+    """
+
+    def test_ttls(self):
+        """
+        Test that items are served within their TTL and expired or stale ones are not
+        """
+        store = inventory_utils.InventoryStore('/nonexistent/inventory.json',
+                                               {'bundles': 60})
+        store.put('us-east-1', 'bundles', {'b': 1})
+        store.put('us-east-1', 'workspaces', [1])
+        store.put('us-east-1', 'images', {'i': 1}, time.time() - 3600)
+        self.assertEqual(store.get('us-east-1', 'bundles'), {'b': 1})
+        self.assertIsNone(store.get('us-east-1', 'workspaces'))
+        self.assertIsNone(store.get('us-east-1', 'images'))
+        self.assertIsNone(store.get('eu-west-1', 'bundles'))
+        store.expire('us-east-1', 'bundles')
+        self.assertIsNone(store.get('us-east-1', 'bundles'))
+
+    def test_get_store(self):
+        """
+        Test that the store is shared, persisted, and re-read once another run saves it
+        """
+        self.addCleanup(inventory_utils.STORE_CACHE.clear)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            config = {'inventory_file': os.path.join(temp_dir, 'inventory.json')}
+            self.assertIsNone(inventory_utils.get_store({}))
+            store = inventory_utils.get_store(config)
+            self.assertIs(inventory_utils.get_store(config), store)
+            store.put('us-east-1', 'bundles', {'b': {'CreationTime': datetime.datetime(2021, 8, 1)}})
+            inventory_utils.save_store(config)
+            self.assertIs(inventory_utils.get_store(config), store)
+            other = inventory_utils.InventoryStore(config['inventory_file'])
+            other.put('us-east-1', 'images', {})
+            time.sleep(0.01)
+            other.save()
+            self.assertIs(inventory_utils.get_store(config), store)
+            self.assertEqual(store.get('us-east-1', 'images'), {})
+            self.assertEqual(store.get('us-east-1', 'bundles'),
+                             {'b': {'CreationTime': '2021-08-01 00:00:00'}})
+
+    def test_save_merges(self):
+        """
+        Test that saving keeps what other functions saved and this store's puts and expirations
+        """
+        with tempfile.TemporaryDirectory() as temp_dir:
+            file_name = os.path.join(temp_dir, 'inventory.json')
+            first = inventory_utils.InventoryStore(file_name)
+            first.put('us-east-1', 'bundles', {'b': 1})
+            first.put('us-east-1', 'images', {'i': 1})
+            first.save()
+            store = inventory_utils.InventoryStore(file_name)
+            other = inventory_utils.InventoryStore(file_name)
+            other.put('us-east-1', 'directories', {'d': 1})
+            other.put('us-east-1', 'workspaces', [2], time.time() + 60)
+            other.save()
+            store.expire('us-east-1', 'images')
+            store.put('us-east-1', 'workspaces', [1])
+            store.put('eu-west-1', 'bundles', {'b': 2})
+            store.save()
+            saved = inventory_utils.InventoryStore(file_name).state
+            self.assertEqual(sorted(saved['us-east-1']), ['bundles', 'directories', 'workspaces'])
+            self.assertEqual(saved['us-east-1']['workspaces']['items'], [2])
+            self.assertEqual(saved['eu-west-1']['bundles']['items'], {'b': 2})
+            self.assertEqual(store.state, saved)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+"""
+   Tests for metrics_utils.py
+   Called via nosetests test_metrics_utils.py
+"""
+
+# Global imports
+import contextlib
+import io
+import json
+import os
+import unittest
+from unittest import mock
+
+from botocore.exceptions import ClientError
+
+# Local imports
+import aws_workspace_utils
+import metrics_utils
+
+
+class ThrottledStub():
+    '''
+    Stand-in boto client throttling the first call of describe_workspaces
+    '''
+    def __init__(self):
+        self.throttled = False
+
+    def describe_workspaces(self, **kwargs):
+        if not self.throttled:
+            self.throttled = True
+            raise ClientError({'Error': {'Code': 'ThrottlingException'}}, 'DescribeWorkspaces')
+        return {'Workspaces': []}
+
+
+class TestMetrics(unittest.TestCase):
+    """
+    Standard test class, for all metrics_utils functions
+    """
+
+    def setUp(self):
+        metrics_utils.METRICS.clear()
+        self.addCleanup(metrics_utils.METRICS.clear)
+
+    def emit_lines(self, env):
+        '''
+        Emit the metrics recorded so far under env, returning the parsed lines
+        '''
+        output = io.StringIO()
+        with mock.patch.dict(os.environ, env, clear=True), contextlib.redirect_stdout(output):
+            metrics_utils.emit('workspacer')
+        return [json.loads(i) for i in output.getvalue().splitlines()]
+
+    def test_instrumented_client(self):
+        """
+        Test that calls, throttles and backoff retries are recorded per operation and region
+        """
+        client = metrics_utils.instrument(ThrottledStub(), 'WorkSpaces', 'us-east-1')
+        with mock.patch.object(aws_workspace_utils, 'BACKOFF_BASE_SECONDS', 0.001):
+            aws_workspace_utils.call_with_backoff(client.describe_workspaces)
+        stats = metrics_utils.snapshot()[('WorkSpaces', 'describe_workspaces', 'us-east-1')]
+        self.assertEqual((stats.calls, stats.errors, stats.throttles, stats.retries),
+                         (2, 1, 1, 1))
+        self.assertEqual(sum(stats.buckets), 2)
+
+    def test_emit(self):
+        """
+        Test the EMF lines inside Lambda, plain JSON elsewhere, and the reset after emitting
+        """
+        metrics_utils.record('WorkSpaces', 'describe_workspaces', 'us-east-1', 5)
+        metrics_utils.record('WorkSpaces', 'describe_workspaces', 'us-east-1', 20000, '500')
+        [line] = self.emit_lines({'AWS_LAMBDA_FUNCTION_NAME': 'workspacer'})
+        self.assertEqual(line['_aws']['CloudWatchMetrics'][0]['Namespace'], 'AWSWorkspaceMaker')
+        self.assertEqual((line['Calls'], line['Errors'], line['Throttles']), (2, 1, 0))
+        self.assertEqual(line['Latency'], {'Values': [10, 20000], 'Counts': [1, 1]})
+        self.assertEqual(self.emit_lines({}), [])
+
+        metrics_utils.record('GitLab', 'get', 'gitlab.sample.com', 30)
+        [line] = self.emit_lines({})
+        self.assertNotIn('_aws', line)
+        self.assertEqual(line['LatencyMs']['mean'], 30)
+
+    def test_emitted(self):
+        """
+        Test that a decorated handler emits its metrics even when it exits
+        """
+        @metrics_utils.emitted('workspacer')
+        def handler():
+            metrics_utils.record('SecretsManager', 'get_secret_value', 'us-west-2', 1)
+            raise SystemExit(1)
+
+        with self.assertRaises(SystemExit), contextlib.redirect_stdout(io.StringIO()):
+            handler()
+        self.assertEqual(metrics_utils.snapshot(), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
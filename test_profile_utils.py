@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+"""
+   Tests for profile_utils.py
+   Called via nosetests test_profile_utils.py
+"""
+
+# Global imports
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+# Local imports
+import profile_utils
+
+
+def busy_region(region):
+    '''
+    Stand-in region worker
+    '''
+    return sorted(str(i) for i in range(2000)), region
+
+
+@profile_utils.profiled('workspacetest')
+def handler(event, context):  # pylint: disable=unused-argument
+    '''
+    Stand-in lambda handler running its regions on worker threads
+    '''
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        return len(list(executor.map(busy_region, ['us-east-1', 'eu-west-1'])))
+
+
+class TestProfile(unittest.TestCase):
+    """
+    Standard test class, for all profile_utils functions
+    """
+
+    def test_disabled(self):
+        """
+        Test that handlers run unprofiled without WORKSPACE_PROFILE
+        """
+        output = io.StringIO()
+        with mock.patch.dict(os.environ, {}, clear=True), contextlib.redirect_stdout(output):
+            self.assertEqual(handler({}, None), 2)
+        self.assertEqual(output.getvalue(), '')
+
+    def test_log(self):
+        """
+        Test that the report covers the worker threads and is printed
+        """
+        output = io.StringIO()
+        # list every function, so the worker's appear however the run's timings order them
+        with mock.patch.dict(os.environ, {profile_utils.PROFILE_ENV: 'log'}), \
+             mock.patch.object(profile_utils, 'PROFILE_TOP', 1000), \
+             contextlib.redirect_stdout(output):
+            self.assertEqual(handler({}, None), 2)
+        report = output.getvalue()
+        self.assertIn('Profile of workspacetest: wall', report)
+        self.assertIn('busy_region', report)
+        self.assertIn('Top allocations:', report)
+
+    def test_process_wide_profiler(self):
+        """
+        Test that with one process-wide profiler (Python 3.12+) no thread hook is installed
+        and a profiler that cannot be enabled leaves the thread running
+        """
+        with mock.patch.object(profile_utils, 'PROCESS_WIDE_PROFILER', True), \
+             mock.patch.dict(os.environ, {profile_utils.PROFILE_ENV: 'log'}), \
+             contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(handler({}, None), 2)
+        run_profile = profile_utils.RunProfile()
+        with mock.patch.object(profile_utils.cProfile.Profile, 'enable',
+                               side_effect=ValueError('Another profiling tool is already active')):
+            run_profile.profile_thread(None, 'call', None)
+        self.assertEqual(run_profile.profiles, [])
+
+    def test_directory(self):
+        """
+        Test that the report is written to the WORKSPACE_PROFILE directory
+        """
+        with tempfile.TemporaryDirectory() as temp_dir, \
+             mock.patch.dict(os.environ, {profile_utils.PROFILE_ENV: temp_dir}), \
+             contextlib.redirect_stdout(io.StringIO()):
+            handler({}, None)
+            [file_name] = os.listdir(temp_dir)
+            self.assertTrue(file_name.startswith('workspacetest-profile-'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+"""
+   Tests for workspacecleanup.py
+   Called via nosetests test_workspacecleanup.py
+"""
+
+# Global imports
+import unittest
+
+# Local imports
+import workspacecleanup
+
+
+class TestWorkspaceCleanup(unittest.TestCase):
+    """
+    Standard test class, for all workspacecleanup functions
+    """
+
+    def test_plan_cleanup(self):
+        """
+        Test which bundles and images are deleted, and why the others are kept
+        """
+        bundles = {'zara_win10_20210705': {'BundleId': 'b-1', 'ImageId': 'i-1',
+                                           'Name': 'zara_win10_20210705'},
+                   'zara_win10_20210801': {'BundleId': 'b-2', 'ImageId': 'i-2',
+                                           'Name': 'zara_win10_20210801'},
+                   'zara_win10_20210801_copy': {'BundleId': 'b-3', 'ImageId': 'i-2',
+                                                'Name': 'zara_win10_20210801_copy'},
+                   'zara_win10_20210805': {'BundleId': 'b-4', 'ImageId': 'i-4',
+                                           'Name': 'zara_win10_20210805'},
+                   'zara_win10_20210720': {'BundleId': 'b-5', 'ImageId': 'i-5',
+                                           'Name': 'zara_win10_20210720'},
+                   'other_win10_20210101': {'BundleId': 'b-6', 'ImageId': 'i-6',
+                                            'Name': 'other_win10_20210101'}}
+        images = {'zara_orphan': {'ImageId': 'i-7', 'Name': 'zara_orphan'},
+                  'other_orphan': {'ImageId': 'i-8', 'Name': 'other_orphan'},
+                  'zara_win10_20210705': {'ImageId': 'i-1', 'Name': 'zara_win10_20210705'}}
+        ws_list = [{'BundleId': 'b-3'}, {'BundleId': 'b-3'}]
+        plan = workspacecleanup.plan_cleanup(ws_list, bundles, images, {'default': 'b-4'}, 'zara')
+        self.assertEqual(sorted(plan['bundles']), ['b-1', 'b-2', 'b-5'])
+        # i-2 is shared with b-3, which is still in use
+        self.assertEqual(sorted(plan['images']), ['i-1', 'i-5', 'i-7'])
+        self.assertEqual(plan['kept'], {'zara_win10_20210801_copy': 'in use by 2 workspaces',
+                                        'zara_win10_20210805': 'latest bundle',
+                                        'other_win10_20210101': 'not part of workspace_maker'})
+        self.assertEqual(workspacecleanup.get_deletes(ws_list, bundles, images, {'default': 'b-4'},
+                                                      'zara'),
+                         (plan['bundles'], plan['images']))
+
+if __name__ == '__main__':
+    unittest.main()
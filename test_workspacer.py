@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+"""
+   Tests for workspacer.py
+   Called via nosetests test_workspacer.py
+"""
+
+# Global imports
+import unittest
+
+# Local imports
+import workspacer
+
+
+class TestWorkspacer(unittest.TestCase):
+    """
+    Standard test class, for all workspacer functions
+    """
+
+    def test_check_workspace_exists(self):
+        """
+        Test the indexed lookup used to skip already provisioned users
+        """
+        existing_ws = [{'UserName': 'devnameone', 'DirectoryId': 'd-1'},
+                       {'UserName': 'devnametwo', 'DirectoryId': 'd-2'}]
+        index = workspacer.build_workspace_index(existing_ws)
+        directory_ids = {'us-east-1-production': 'd-1', 'us-east-1-admin': 'd-2'}
+        self.assertTrue(workspacer.check_workspace_exists({'UserName': 'devnameone'},
+                                                          'us-east-1-production',
+                                                          index, directory_ids))
+        self.assertFalse(workspacer.check_workspace_exists({'UserName': 'devnameone'},
+                                                           'us-east-1-admin',
+                                                           index, directory_ids))
+        self.assertTrue(workspacer.check_workspace_exists({'UserName': 'devnametwo'},
+                                                          'us-east-1-admin',
+                                                          index, directory_ids))
+
+    def test_diff_user_lists(self):
+        """
+        Test the user file diff used for incremental provisioning
+        """
+        previous = [{'UserName': 'one', 'Directory': 'production', 'Region': 'us-east-1', 'Team': 'a'},
+                    {'UserName': 'two', 'Directory': 'production', 'Region': 'us-east-1', 'Team': 'a'},
+                    {'UserName': 'three', 'Directory': 'admin', 'Region': 'eu-west-1', 'Team': 'b'}]
+        current = [{'UserName': 'one', 'Directory': 'production', 'Region': 'us-east-1', 'Team': 'a'},
+                   {'UserName': 'two', 'Directory': 'production', 'Region': 'us-east-1', 'Team': 'b'},
+                   {'UserName': 'four', 'Directory': 'test', 'Region': 'us-east-1', 'Team': 'a'}]
+        added, removed, changed = workspacer.diff_user_lists(previous, current)
+        self.assertEqual([i['UserName'] for i in added], ['four'])
+        self.assertEqual([i['UserName'] for i in removed], ['three'])
+        self.assertEqual([i['UserName'] for i in changed], ['two'])
+        requested = workspacer.determine_changed_requests({'users': previous}, current)
+        self.assertEqual(workspacer.determine_regions(requested), {'us-east-1': 1})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+"""
+   Tests for workspacerefresh.py
+   Called via nosetests test_workspacerefresh.py
+"""
+
+# Global imports
+import datetime
+import unittest
+
+# Local imports
+import workspacerefresh
+
+
+class TestWorkspaceRefresh(unittest.TestCase):
+    """
+    Standard test class, for all workspacerefresh functions
+    """
+
+    def test_in_maintenance_window(self):
+        """
+        Test daytime and overnight windows
+        """
+        self.assertTrue(workspacerefresh.in_maintenance_window(None))
+        window = {'start': '02:00', 'end': '06:00'}
+        self.assertTrue(workspacerefresh.in_maintenance_window(window, datetime.time(3, 30)))
+        self.assertFalse(workspacerefresh.in_maintenance_window(window, datetime.time(6, 0)))
+        overnight = {'start': '22:00', 'end': '04:00'}
+        self.assertTrue(workspacerefresh.in_maintenance_window(overnight, datetime.time(23, 0)))
+        self.assertTrue(workspacerefresh.in_maintenance_window(overnight, datetime.time(1, 0)))
+        self.assertFalse(workspacerefresh.in_maintenance_window(overnight, datetime.time(12, 0)))
+
+    def test_schedule_migrations(self):
+        """
+        Test that the budget caps each run and the cursor resumes where the last run stopped
+        """
+        ws_refresh = [{'WorkSpaceId': 'ws-{}'.format(i)} for i in (5, 1, 4, 2, 3)]
+        batch, cursor = workspacerefresh.schedule_migrations(ws_refresh, None, 2)
+        self.assertEqual([i['WorkSpaceId'] for i in batch], ['ws-1', 'ws-2'])
+        self.assertEqual(cursor, 'ws-2')
+        batch, cursor = workspacerefresh.schedule_migrations(ws_refresh, cursor, 2)
+        self.assertEqual([i['WorkSpaceId'] for i in batch], ['ws-3', 'ws-4'])
+        batch, cursor = workspacerefresh.schedule_migrations(ws_refresh, cursor, 2)
+        self.assertEqual([i['WorkSpaceId'] for i in batch], ['ws-5', 'ws-1'])
+        batch, cursor = workspacerefresh.schedule_migrations(ws_refresh, 'ws-3', None)
+        self.assertEqual(len(batch), 5)
+        self.assertIsNone(cursor)
+        batch, cursor = workspacerefresh.schedule_migrations(ws_refresh, 'ws-3', 0)
+        self.assertEqual((batch, cursor), ([], 'ws-3'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -18,10 +18,16 @@ Called via lambda function
    limitations under the License.
 """
 
+import collections
+import functools
+
 import botocore
 
-import aws_workspace_utils as aws_ws
 import common_utils as utils
+import inventory_utils as inventory
+import metrics_utils as metrics
+import plan_utils
+import profile_utils as profile
 
 CONFIG_FILE="./config/workspace_config.json"
 ACCOUNT = "aws_workspace_cleanup"
@@ -50,55 +56,137 @@ def get_deletes(ws_list, existing_bundles, existing_images, bundle_map, zara_pre
     '''
     Given a set of managed workspaces and bundles, get non-latest bundles and images to delete
     '''
+    plan = plan_cleanup(ws_list, existing_bundles, existing_images, bundle_map, zara_prefix)
+
+    return plan['bundles'], plan['images']
+
+
+def get_latest_total_bundle_map(bundles, team_map):
+    '''
+    Given a set of existing bundles and teams (including default)
+    Return latest as a map
+    '''
+    bundle_map = {}
+    teams = list(team_map.keys())
+    teams.append("default")
+    bundle_index = utils.BundleIndex(bundles)
+    for team in teams:
+        bundle_map[team] = bundle_index.latest_bundle_id(team)
+
+    return bundle_map
+
+
+def plan_cleanup(ws_list, existing_bundles, existing_images, bundle_map, zara_prefix):
+    '''
+    Given the workspaces, bundles and images in a region, plan the non-latest bundles and
+    images to delete using precomputed sets and reference counts.
+    Returns a dict of:
+      bundles: bundle ids to delete
+      images: image ids to delete, once every bundle referencing them is deleted
+      image_bundles: {image_id: [bundle ids referencing it]}
+      kept: {bundle name: reason it was kept}
+    '''
     bundle_deletes = []
     image_deletes = []
-    bundled_images = []
-    # Determine if each instance has the latest bundle
-    used_bundles = [ws.get("BundleId")  for ws in ws_list]
-    latest_bundles = bundle_map.values()
+    kept = {}
+    latest_bundles = set(bundle_map.values())
+    bundle_workspaces = collections.Counter(ws.get('BundleId') for ws in ws_list)
+    bundle_images = {}
+    image_bundles = collections.defaultdict(list)
+    for bundle in existing_bundles.values():
+        bundle_images[bundle.get('BundleId')] = bundle.get('ImageId')
+        image_bundles[bundle.get('ImageId')].append(bundle.get('BundleId'))
     for bundle in existing_bundles.values():
-        image_id = bundle.get('ImageId')
-        bundled_images.append(image_id)
         bundle_id = bundle.get("BundleId")
         name = bundle.get("Name")
         # if bundle is the latest, skip
         if bundle_id in latest_bundles:
-            print('Info: Skipping latest bundle {}'.format(name))
-            continue
+            kept[name] = 'latest bundle'
         # if bundle is attached to workspace (causing delete failure), skip
-        if bundle_id in used_bundles:
-            print('Info: Skipping bundle {} in use by workspace'.format(name))
-            continue
+        elif bundle_workspaces[bundle_id]:
+            kept[name] = 'in use by {} workspaces'.format(bundle_workspaces[bundle_id])
         # if bundle is not part of workspace_maker system, skip
-        if not name.startswith(zara_prefix):
-            print('Info: Skipping bundle {} not part of workspace_maker'.format(name))
+        elif not name.startswith(zara_prefix):
+            kept[name] = 'not part of workspace_maker'
+        else:
+            print('Info: Queueing bundle/image {}'.format(name))
+            bundle_deletes.append(bundle_id)
             continue
-
-        print('Info: Queueing bundle/image {}'.format(name))
-        bundle_deletes.append(bundle_id)
-        image_deletes.append(image_id)
+        print('Info: Skipping bundle {}: {}'.format(name, kept[name]))
+
+    # an image can only go once no remaining bundle references it
+    deleted_bundles = set(bundle_deletes)
+    queued_images = set()
+    for bundle_id in bundle_deletes:
+        image_id = bundle_images[bundle_id]
+        if image_id in queued_images:
+            continue
+        if all(i in deleted_bundles for i in image_bundles[image_id]):
+            queued_images.add(image_id)
+            image_deletes.append(image_id)
+        else:
+            print('Info: Keeping image {} shared with a kept bundle'.format(image_id))
 
     # add in unbundled images
-    image_deletes.extend(determine_unattached_images(existing_images, bundled_images,zara_prefix))
+    image_deletes.extend(determine_unattached_images(existing_images, set(image_bundles),
+                                                     zara_prefix))
 
-    return bundle_deletes, image_deletes
+    return {'bundles': bundle_deletes,
+            'images': image_deletes,
+            'image_bundles': dict(image_bundles),
+            'kept': kept}
 
 
-def get_latest_total_bundle_map(bundles, team_map):
+def plan_region(config, snapshot, plan=None):
     '''
-    Given a set of existing bundles and teams (including default)
-    Return latest as a map
+    Add the bundle and image deletes due in a region snapshot to plan (a new one by default)
     '''
-    bundle_map = {}
-    teams = list(team_map.keys())
-    teams.append("default")
-    # calculate Aliases, ensure they exist
-    for team in teams:
-        bundle_map[team] = utils.determine_team_bundle_id(bundles, team)
+    plan = plan or plan_utils.RegionPlan(snapshot.region)
+    bundle_map = get_latest_total_bundle_map(snapshot.bundles, config['team_workspaces'])
+    # every workspace counts, since a bundle in use by anyone cannot be deleted
+    cleanup = plan_cleanup(snapshot.workspaces, snapshot.bundles, snapshot.images, bundle_map,
+                           config['supported_prefix'])
+    plan.bundle_deletes.extend(cleanup['bundles'])
+    plan.image_deletes.extend(cleanup['images'])
+    plan.image_bundles.update(cleanup['image_bundles'])
+    plan.kept.update(cleanup['kept'])
 
-    return bundle_map
+    return plan
+
+
+def process_region(config, region, dry_run=False):
+    '''
+    Delete down-rev bundles and images in a single region, returning a summary
+    '''
+    client = plan_utils.new_client(region, config)
+    try:
+        print('Examining region {}'.format(region))
+        snapshot = plan_utils.new_snapshot(client, region, config)
+        plan = plan_region(config, snapshot)
+        if dry_run:
+            plan_utils.print_plan(plan)
+            return plan_utils.summarize_plan(plan)
+        report = plan_utils.apply_plan(plan, client, config, snapshot)
+    except botocore.exceptions.SSLError:
+        print("Info: unable to connect to workspaces in region {}".format(region))
+        return {'skipped': 'unreachable'}
+
+    return summarize_deletes(plan, report)
+
+
+def summarize_deletes(plan, report):
+    '''
+    The per-region summary of the applied deletes
+    '''
+    deleted = collections.Counter(i['Type'] for i in report['deletes'].values() if i['Success'])
 
+    return {'bundles_deleted': deleted['bundle'], 'images_deleted': deleted['image'],
+            'bundles_kept': len(plan.kept),
+            'delete_failures': len([i for i in report['deletes'].values() if not i['Success']])}
 
+
+@metrics.emitted('workspacecleanup')
+@profile.profiled('workspacecleanup')
 def main(event, context):
     '''
     main function:cleanup images and bundles
@@ -106,26 +194,10 @@ def main(event, context):
     # load the config
     config = utils.load_config_json(CONFIG_FILE)
 
-    for region in config['supported_regions']:
-        client = aws_ws.WorkSpaceClient(region)
-        try:
-            print('Examining region {}'.format(region))
-            existing_ws = client.get_current_workspaces()
-            existing_bundles = client.get_current_bundles()
-            existing_images = client.get_current_images()
-            bundle_map = get_latest_total_bundle_map(existing_bundles, config['team_workspaces'])
-            result = get_deletes(existing_ws, existing_bundles, existing_images, bundle_map,
-                                 config['supported_prefix'])
-            bundles = result[0]
-            images = result[1]
-            for bundle in bundles:
-                print('Deleting bundleid {} in region {}'.format(bundle, region))
-                client.delete_bundle(bundle_id=bundle)
-            for image in images:
-                print('Deleting imageid {} in region {}'.format(image, region))
-                client.delete_image(image_id=image)
-        except botocore.exceptions.SSLError:
-            print("Info: unable to connect to workspaces in region {}".format(region))
-
-
-#main('foo','bar')
+    summary = utils.run_regions(config['supported_regions'],
+                                functools.partial(process_region, config,
+                                                  dry_run=plan_utils.is_dry_run(config, event)),
+                                config.get('region_concurrency', utils.REGION_CONCURRENCY))
+    inventory.save_store(config)
+
+    return summary
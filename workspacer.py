@@ -17,39 +17,65 @@ Called via lambda function
    See the License for the specific language governing permissions and
    limitations under the License.
 """
+import copy
+import functools
 import sys
+import time
 
-import aws_workspace_utils as aws_ws
 import aws_secret_utils as secrets
-import gitlab_utils as gitlab
 import common_utils as utils
+import inventory_utils as inventory
+import metrics_utils as metrics
+import plan_utils
+import profile_utils as profile
 
 
 CONFIG_FILE="./config/workspace_config.json"
 ACCOUNT = "aws_workspace_maker"
+FULL_SWEEP_HOURS = 24
 
 
-def check_workspace_exists(ws_instance, ws_alias, existing_ws_list, directory_ids):
+def build_workspace_index(existing_ws_list):
+    '''
+    Index existing workspaces by (UserName, DirectoryId), built once per region
+    '''
+    return {(workspace.get('UserName'), workspace.get('DirectoryId'))
+            for workspace in existing_ws_list}
+
+
+def check_workspace_exists(ws_instance, ws_alias, existing_ws_index, directory_ids):
     '''
     A user can have one workspace in a directory
     '''
-    exists = False
-    for workspace in existing_ws_list:
-        if ws_instance.get('UserName') == workspace.get('UserName') and \
-           directory_ids[ws_alias] == workspace.get('DirectoryId'):
-            exists = True
+    return (ws_instance.get('UserName'), directory_ids[ws_alias]) in existing_ws_index
 
-    return exists
 
+def determine_changed_requests(snapshot, ws_list):
+    '''
+    Given the last processed user snapshot, return only the added or changed requests
+    '''
+    added, removed, changed = diff_user_lists(snapshot.get('users', []), ws_list)
+    print('Info: User file changes since commit {}: {} added, {} removed, {} changed'.format(
+        snapshot.get('commit_id'), len(added), len(removed), len(changed)))
+    for ws_instance in removed:
+        print('Info: User {} removed from {}-{} is not deprovisioned'.format(
+            ws_instance.get('UserName'), ws_instance.get('Region'), ws_instance.get('Directory')))
+
+    return added + changed
 
-def determine_new_workspaces(config, bundles, existing_dirs, existing_ws, region, ws_list):
+
+def determine_new_workspaces(config, bundles, existing_dirs, existing_ws, region, ws_list,
+                             dropped=None):
     '''
-    Given a set of existing workspaces, determine what needs to be created
+    Given a set of existing workspaces, determine what needs to be created.
+    Requests that cannot be planned (no directory or bundle) are appended to dropped, if given
     '''
     new_ws = []
     # calculate Aliases, ensure they exist
     aliases_map = get_directory_id_map(region, config.get('directory_suffixes'), existing_dirs)
     aliases = aliases_map.keys()
+    existing_ws_index = build_workspace_index(existing_ws)
+    bundle_index = utils.BundleIndex(bundles)
     #for each requested ws.
     for ws_instance in ws_list:
         if ws_instance['Region'] != region:
@@ -60,12 +86,14 @@ def determine_new_workspaces(config, bundles, existing_dirs, existing_ws, region
         if ws_alias not in aliases:
             print('Error: Requested Directory {} for workspace user {} not found'.format(ws_alias,
                                                                                          ws_instance.get('UserName')))
-        elif check_workspace_exists(ws_instance, ws_alias, existing_ws, aliases_map):
+            if dropped is not None:
+                dropped.append(ws_instance)
+        elif check_workspace_exists(ws_instance, ws_alias, existing_ws_index, aliases_map):
             print('Info: Skipping user {} who is already provisioned in {}'.format(ws_instance.get('UserName'),
                                                                                    ws_alias))
         else:
             # Start with team's config from json file
-            ws_config = config['team_workspaces'][ws_instance.get('Team')]
+            ws_config = copy.deepcopy(config['team_workspaces'][ws_instance.get('Team')])
 
             if ws_instance.get('Directory') in config["directory_suffixes_non_encrypted"]:
                 # Remove encryption requirements present in config
@@ -74,12 +102,14 @@ def determine_new_workspaces(config, bundles, existing_dirs, existing_ws, region
                 del ws_config["RootVolumeEncryptionEnabled"]
             ws_config['UserName'] = ws_instance['UserName']
             ws_config['DirectoryId'] = aliases_map[ws_alias]
-            ws_config['BundleId'] = utils.determine_team_bundle_id(bundles, ws_instance.get('Team'))
+            ws_config['BundleId'] = bundle_index.latest_bundle_id(ws_instance.get('Team'))
             # add to list to provision.
             if ws_config['BundleId']:
                 new_ws.append(ws_config)
             else:
                 print("Error: Ignoring request to provision workspace for user:{}".format(ws_config.get('UserName')))
+                if dropped is not None:
+                    dropped.append(ws_instance)
 
     return new_ws
 
@@ -94,6 +124,24 @@ def determine_regions(workstation_list):
     return regions
 
 
+def diff_user_lists(previous_list, current_list):
+    '''
+    Compare two user lists keyed by (UserName, Region, Directory).
+    Returns the added, removed and changed records
+    '''
+    def user_key(ws_instance):
+        return (ws_instance.get('UserName'), ws_instance.get('Region'), ws_instance.get('Directory'))
+
+    previous_map = {user_key(i): i for i in previous_list or []}
+    current_map = {user_key(i): i for i in current_list or []}
+    added = [i for key, i in current_map.items() if key not in previous_map]
+    removed = [i for key, i in previous_map.items() if key not in current_map]
+    changed = [i for key, i in current_map.items()
+               if key in previous_map and previous_map[key] != i]
+
+    return added, removed, changed
+
+
 def get_directory_id_map(region, suffixes, existing_dirs):
     '''
     Return the list of directory aliases used by workspace_maker
@@ -110,13 +158,19 @@ def get_directory_id_map(region, suffixes, existing_dirs):
     return aliases
 
 
-def main(event, context):
+def is_full_sweep_due(snapshot, full_sweep_hours):
     '''
-    main function: provision the workspaces
+    A full reconcile is due without a snapshot, or when the last one is older than full_sweep_hours
     '''
-    # load the config
-    config = utils.load_config_json(CONFIG_FILE)
+    return time.time() - snapshot.get('swept_at', 0) >= full_sweep_hours * 3600
+
 
+def get_requests(config):
+    '''
+    Load the user file from GitLab and decide what this run reconciles.
+    Returns {'requested', 'users', 'commit_id', 'sweep_due', 'snapshot'},
+    or None when the user file is unchanged since the last run
+    '''
     # load the secret token
     try:
         client = secrets.SecretsClient(config['secret_info'].get('region'))
@@ -127,35 +181,123 @@ def main(event, context):
         print("Critical: Could not retrieve secret. Are you logged in to AWS?")
         sys.exit(1)
 
-    # load the gitlab file
+    # load the gitlab file; requests is only imported once it is needed
+    import gitlab_utils as gitlab  # pylint: disable=import-outside-toplevel
     client = gitlab.GitLabClient(config.get('gitlab_url'), token)
     if not client.check_gitlab_alive():
         print("Critical: GitLab not healthy.")
         sys.exit(1)
+    # with a snapshot file, reconcile only the users changed since the last run
+    snapshot_file = config.get('snapshot_file')
+    snapshot = utils.load_state_json(snapshot_file) if snapshot_file else {}
+    sweep_due = bool(snapshot_file) and is_full_sweep_due(snapshot,
+                                                          config.get('full_sweep_hours',
+                                                                     FULL_SWEEP_HOURS))
+    # with a cache file, skip the run entirely if the user file has not changed
+    cache_file = config.get('gitlab_cache_file')
+    commit_id = None
+    if cache_file or snapshot_file:
+        commit_id = client.get_file_commit_id(config.get('gitlab_project_id'),
+                                              config.get('gitlab_filename'),
+                                              config.get('gitlab_branch'))
+    if cache_file and not sweep_due and commit_id and \
+       commit_id == utils.load_state_json(cache_file).get('commit_id'):
+        print("Info: User file unchanged at commit {}. Exiting normally.".format(commit_id))
+        return None
     ws_list = client.get_json_file(config.get('gitlab_project_id'),
                                    config.get('gitlab_filename'),
                                    config.get('gitlab_branch'))
+    requested = ws_list
+    if snapshot_file and not sweep_due:
+        requested = determine_changed_requests(snapshot, ws_list)
+    else:
+        print("Info: Reconciling all requested workspaces")
+
+    return {'requested': requested, 'users': ws_list, 'commit_id': commit_id,
+            'sweep_due': sweep_due, 'snapshot': snapshot}
+
+
+def plan_region(config, ws_list, snapshot, plan=None):
+    '''
+    Add the workspaces missing from a region snapshot to plan (a new one by default)
+    '''
+    plan = plan or plan_utils.RegionPlan(snapshot.region)
+    # only workspaces in managed directories can match a request
+    plan.creates.extend(determine_new_workspaces(config, snapshot.bundles, snapshot.directories,
+                                                 snapshot.managed_workspaces, snapshot.region,
+                                                 ws_list, plan.dropped))
+
+    return plan
+
+
+def process_region(config, ws_list, region, dry_run=False):
+    '''
+    Create the missing workspaces for a single region, returning a summary of the results
+    '''
+    client = plan_utils.new_client(region, config)
+    snapshot = plan_utils.new_snapshot(client, region, config)
+    plan = plan_region(config, ws_list, snapshot)
+    if dry_run:
+        plan_utils.print_plan(plan)
+        return plan_utils.summarize_plan(plan)
+
+    return summarize_creates(plan, plan_utils.apply_plan(plan, client, config, snapshot))
+
+
+def record_progress(config, user_requests):
+    '''
+    Save the user file commit and snapshot that this run fully processed
+    '''
+    cache_file = config.get('gitlab_cache_file')
+    snapshot_file = config.get('snapshot_file')
+    if cache_file and user_requests['commit_id']:
+        utils.save_state_json(cache_file, {'commit_id': user_requests['commit_id']})
+    if snapshot_file:
+        utils.save_state_json(snapshot_file,
+                              {'commit_id': user_requests['commit_id'],
+                               'swept_at': time.time() if user_requests['sweep_due'] else
+                                           user_requests['snapshot']['swept_at'],
+                               'users': user_requests['users']})
+
+
+def summarize_creates(plan, report):
+    '''
+    The per-region summary of the applied creates; unprocessed counts the requests
+    that could not be planned, which are retried on the next run
+    '''
+    created = len([i for i in report['creates'].values() if i['Success']])
+
+    return {'created': created, 'failed': len(report['creates']) - created,
+            'unprocessed': len(plan.dropped)}
+
+
+@metrics.emitted('workspacer')
+@profile.profiled('workspacer')
+def main(event, context):
+    '''
+    main function: provision the workspaces
+    '''
+    # load the config
+    config = utils.load_config_json(CONFIG_FILE)
+    dry_run = plan_utils.is_dry_run(config, event)
+    user_requests = get_requests(config)
+    if user_requests is None:
+        return {}
     # Workspaces runs on a region by region basis.
     try:
-        regions = determine_regions(ws_list)
+        regions = determine_regions(user_requests['requested'])
     except AttributeError:
         print("No workspaces requested. Exiting normally.")
         sys.exit(0)
 
-    for region in regions:
-        client = aws_ws.WorkSpaceClient(region)
-        bundles = client.get_current_bundles()
-        existing_ws = client.get_current_workspaces()
-        existing_dirs = client.get_current_directories()
-        new_ws_list = determine_new_workspaces(config, bundles, existing_dirs, existing_ws,
-                                               region, ws_list)
-        for create_ws in new_ws_list:
-            response = client.create_workspace(create_ws)
-            if len(response["FailedRequests"]) > 0:
-                print("Error: Failed to create workspace for user {}".format(create_ws.get('UserName')))
-                for line in response.keys():
-                    print("detail:{}: {}".format(line, response[line]))
-            else:
-                print("Success: Creating workspace for user {}".format(create_ws.get('UserName')))
+    summary = utils.run_regions(regions,
+                                functools.partial(process_region, config,
+                                                  user_requests['requested'], dry_run=dry_run),
+                                config.get('region_concurrency', utils.REGION_CONCURRENCY))
+    inventory.save_store(config)
+    # only record progress once every request has been handled, so failures are retried
+    if not dry_run and all(i['status'] == 'ok' and not i.get('failed') and
+                           not i.get('unprocessed') for i in summary.values()):
+        record_progress(config, user_requests)
 
-#main('foo','bar')
+    return summary
@@ -18,24 +18,29 @@ Called via lambda function
    limitations under the License.
 """
 
+import datetime
+
 import botocore
 
-import aws_workspace_utils as aws_ws
 import common_utils as utils
+import inventory_utils as inventory
+import metrics_utils as metrics
+import plan_utils
+import profile_utils as profile
 
 CONFIG_FILE="./config/workspace_config.json"
 ACCOUNT = "aws_workspace_refresh"
 
 
-def get_ws_updates(client, ws_list, bundle_map):
+def get_ws_updates(tag_map, ws_list, bundle_map):
     '''
-    Given a set of managed workspaces, determine update targets
+    Given a set of managed workspaces and their tags, determine update targets
     '''
     ws_updates = []
     # Determine if each instance has the latest bundle
     for ws_inst in ws_list:
         user = ws_inst.get('UserName')
-        tags = client.get_tags(ws_inst.get('WorkspaceId'))
+        tags = tag_map.get(ws_inst.get('WorkspaceId')) or []
         tag_dict = {tag['Key']: tag['Value'] for tag in tags}
         team = tag_dict.get('team')
         try:
@@ -57,66 +62,129 @@ def get_ws_updates(client, ws_list, bundle_map):
     return ws_updates
 
 
-def get_directory_ids(region, suffixes, existing_dirs):
-    '''
-    Return the list of directory ids managed by workspace_maker in a region
-    '''
-    ids = []
-    existing_aliases = existing_dirs.keys()
-    for suffix in suffixes:
-        alias = '{}-{}'.format(region, suffix)
-        if alias in existing_aliases:
-            ids.append(existing_dirs[alias].get('DirectoryId'))
-
-    return ids
-
 def get_latest_bundle_map(bundles, teams):
     '''
     Given a set of bundles, determine which is latest for team
     '''
     bundle_map = {}
-    # calculate Aliases, ensure they exist
+    bundle_index = utils.BundleIndex(bundles)
     for team in teams:
-        bundle_map[team] = utils.determine_team_bundle_id(bundles, team)
+        bundle_map[team] = bundle_index.latest_bundle_id(team)
 
     return bundle_map
 
-def get_managed_workspaces(existing_ws_list, directory_ids):
+
+def in_maintenance_window(window, now=None):
     '''
-    A workspace must be in a managed directory
+    True when no window is configured, or the UTC time is within {"start": "HH:MM", "end": "HH:MM"}.
+    A window that ends before it starts spans midnight
     '''
-    managed_ws = []
-    for workspace in existing_ws_list:
-        if workspace.get('DirectoryId') in directory_ids:
-            managed_ws.append(workspace)
+    if not window:
+        return True
+    now = now or datetime.datetime.now(datetime.timezone.utc).time()
+    start = datetime.time.fromisoformat(window['start'])
+    end = datetime.time.fromisoformat(window['end'])
+    if start <= end:
+        return start <= now < end
+    return now >= start or now < end
 
-    return managed_ws
 
+def plan_region(config, snapshot, cursor=None, plan=None):
+    '''
+    Add the migrations due in a region snapshot to plan (a new one by default),
+    resuming after the cursor left by the previous run
+    '''
+    plan = plan or plan_utils.RegionPlan(snapshot.region)
+    bundle_map = get_latest_bundle_map(snapshot.bundles, config['team_workspaces'].keys())
+    ws_refresh = get_ws_updates(snapshot.tags, snapshot.managed_workspaces, bundle_map)
+    batch, plan.cursor = schedule_migrations(ws_refresh, cursor,
+                                             config.get('max_migrations_per_run'))
+    plan.migrations.extend(batch)
+    plan.deferred = len(ws_refresh) - len(batch)
+
+    return plan
 
+
+def process_region(config, region, cursor=None, dry_run=False):
+    '''
+    Migrate out-of-date managed workspaces in a single region, returning a summary.
+    Migrations resume after the cursor left by the previous run
+    '''
+    client = plan_utils.new_client(region, config)
+    try:
+        print('Examining region {}'.format(region))
+        snapshot = plan_utils.new_snapshot(client, region, config)
+        plan = plan_region(config, snapshot, cursor)
+        if dry_run:
+            plan_utils.print_plan(plan)
+            return dict(plan_utils.summarize_plan(plan), cursor=cursor)
+        report = plan_utils.apply_plan(plan, client, config, snapshot)
+    except botocore.exceptions.SSLError:
+        print("Info: unable to connect to workspaces in region {}".format(region))
+        return {'skipped': 'unreachable', 'cursor': cursor}
+
+    return summarize_migrations(snapshot, plan, report)
+
+
+def schedule_migrations(ws_refresh, cursor, budget):
+    '''
+    Order pending migrations by WorkSpaceId, resume after the cursor, and cap them to budget.
+    Returns the batch to run and the cursor for the next run (None once nothing is deferred).
+    Without a budget nothing is deferred, so no cursor is kept
+    '''
+    pending = sorted(ws_refresh, key=lambda i: i.get('WorkSpaceId'))
+    if cursor:
+        start = next((index for index, workspace in enumerate(pending)
+                      if workspace.get('WorkSpaceId') > cursor), len(pending))
+        pending = pending[start:] + pending[:start]
+    if budget is None or len(pending) <= budget:
+        return pending, None
+    if budget <= 0:
+        if pending:
+            print('Info: Deferring {} migrations to the next run'.format(len(pending)))
+        return [], cursor
+    batch = pending[:budget]
+    print('Info: Deferring {} migrations to the next run'.format(len(pending) - budget))
+
+    return batch, batch[-1].get('WorkSpaceId')
+
+
+def summarize_migrations(snapshot, plan, report):
+    '''
+    The per-region summary of the applied migrations
+    '''
+    migrated = len([i for i in report['migrations'].values() if i['Success']])
+
+    return {'managed': len(snapshot.managed_workspaces),
+            'out_of_date': len(plan.migrations) + plan.deferred, 'migrated': migrated,
+            'failed': len(report['migrations']) - migrated, 'cursor': plan.cursor}
+
+
+@metrics.emitted('workspacerefresh')
+@profile.profiled('workspacerefresh')
 def main(event, context):
     '''
     main function: refresh OS drive using latest images
     '''
     # load the config
     config = utils.load_config_json(CONFIG_FILE)
-
-    for region in config['supported_regions']:
-        client = aws_ws.WorkSpaceClient(region)
-        try:
-            print('Examining region {}'.format(region))
-            existing_dirs = client.get_current_directories()
-            managed_ids = get_directory_ids(region, config['directory_suffixes'], existing_dirs)
-            existing_ws = client.get_current_workspaces()
-            managed_ws = get_managed_workspaces(existing_ws, managed_ids)
-            existing_bundles = client.get_current_bundles()
-            bundle_map = get_latest_bundle_map(existing_bundles, config['team_workspaces'].keys())
-            ws_refresh = get_ws_updates(client, managed_ws, bundle_map)
-            for workspace in ws_refresh:
-                print('Migrating user {} in region {}'.format(workspace.get('UserName'), region))
-                client.migrate_workspace(workspace_id=workspace.get('WorkSpaceId'),
-                                         bundle_id=workspace.get('BundleId'))
-        except botocore.exceptions.SSLError:
-            print("Info: unable to connect to workspaces in region {}".format(region))
-
-
-#main('foo','bar')
+    dry_run = plan_utils.is_dry_run(config, event)
+    if not in_maintenance_window(config.get('maintenance_window')):
+        print("Info: Outside the maintenance window. Exiting normally.")
+        return {}
+
+    # per-region cursors let large fleets roll forward across runs
+    cursor_file = config.get('migration_cursor_file')
+    cursors = utils.load_state_json(cursor_file) if cursor_file else {}
+    summary = utils.run_regions(config['supported_regions'],
+                                lambda region: process_region(config, region,
+                                                              cursors.get(region), dry_run),
+                                config.get('region_concurrency', utils.REGION_CONCURRENCY))
+    inventory.save_store(config)
+    if cursor_file and not dry_run:
+        for region, result in summary.items():
+            if result['status'] == 'ok':
+                cursors[region] = result.get('cursor')
+        utils.save_state_json(cursor_file, cursors)
+
+    return summary
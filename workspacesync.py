@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+"""
+Provisions, refreshes and cleans up workspaces in a single pass
+Called via lambda function
+
+   Copyright 2021 Zulily, Inc.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+     http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import botocore
+
+import common_utils as utils
+import inventory_utils as inventory
+import metrics_utils as metrics
+import plan_utils
+import profile_utils as profile
+import workspacecleanup
+import workspacer
+import workspacerefresh
+
+CONFIG_FILE="./config/workspace_config.json"
+
+
+def load_requests(config):
+    '''
+    Load the user file like Workspace Maker, but a failure only skips provisioning:
+    refresh and cleanup still run for every region
+    '''
+    try:
+        return workspacer.get_requests(config)
+    except (Exception, SystemExit) as error:  # pylint: disable=broad-except
+        print("Error: Could not load the user file ({!r}). Not provisioning workspaces.".format(
+            error))
+        return None
+
+
+def plan_region(config, snapshot, ws_list, cursor=None, migrate=True):
+    '''
+    Plan the creates, migrations and deletes of a region from one snapshot
+    '''
+    plan = plan_utils.RegionPlan(snapshot.region)
+    # cleanup lists the whole region first, so the other planners filter it locally
+    workspacecleanup.plan_region(config, snapshot, plan)
+    if ws_list:
+        workspacer.plan_region(config, ws_list, snapshot, plan)
+    if migrate:
+        workspacerefresh.plan_region(config, snapshot, cursor, plan)
+
+    return plan
+
+
+def process_region(config, region, ws_list, cursor=None, migrate=True, dry_run=False):
+    '''
+    Reconcile a single region in one pass, returning a summary
+    '''
+    client = plan_utils.new_client(region, config)
+    try:
+        print('Examining region {}'.format(region))
+        snapshot = plan_utils.new_snapshot(client, region, config)
+        plan = plan_region(config, snapshot, ws_list, cursor, migrate)
+        if dry_run:
+            plan_utils.print_plan(plan)
+            return dict(plan_utils.summarize_plan(plan), cursor=cursor)
+        report = plan_utils.apply_plan(plan, client, config, snapshot)
+    except botocore.exceptions.SSLError:
+        print("Info: unable to connect to workspaces in region {}".format(region))
+        return {'skipped': 'unreachable', 'cursor': cursor}
+
+    creates = workspacer.summarize_creates(plan, report)
+    migrations = workspacerefresh.summarize_migrations(snapshot, plan, report)
+    summary = workspacecleanup.summarize_deletes(plan, report)
+    summary.update({'created': creates['created'], 'create_failures': creates['failed'],
+                    'create_unprocessed': creates['unprocessed'],
+                    'out_of_date': migrations['out_of_date'], 'migrated': migrations['migrated'],
+                    'migration_failures': migrations['failed'], 'cursor': migrations['cursor']})
+
+    return summary
+
+
+@metrics.emitted('workspacesync')
+@profile.profiled('workspacesync')
+def main(event, context):
+    '''
+    main function: provision, refresh and clean up every region from one inventory
+    '''
+    # load the config
+    config = utils.load_config_json(CONFIG_FILE)
+    dry_run = plan_utils.is_dry_run(config, event)
+    # an unchanged or unreadable user file only skips provisioning
+    user_requests = load_requests(config)
+    ws_list = user_requests['requested'] if user_requests else []
+    migrate = workspacerefresh.in_maintenance_window(config.get('maintenance_window'))
+    if not migrate:
+        print("Info: Outside the maintenance window. Not migrating workspaces.")
+    cursor_file = config.get('migration_cursor_file')
+    cursors = utils.load_state_json(cursor_file) if cursor_file else {}
+    regions = sorted(set(config['supported_regions']) |
+                     set(workspacer.determine_regions(ws_list or [])))
+
+    summary = utils.run_regions(regions,
+                                lambda region: process_region(config, region, ws_list,
+                                                              cursors.get(region), migrate,
+                                                              dry_run),
+                                config.get('region_concurrency', utils.REGION_CONCURRENCY))
+    inventory.save_store(config)
+    if dry_run:
+        return summary
+    # a skipped region has not created its users yet, so keep them for the next run
+    if user_requests and all(i['status'] == 'ok' and not i.get('create_failures') and
+                             not i.get('create_unprocessed') and not i.get('skipped')
+                             for i in summary.values()):
+        workspacer.record_progress(config, user_requests)
+    if cursor_file and migrate:
+        for region, result in summary.items():
+            if result['status'] == 'ok':
+                cursors[region] = result.get('cursor')
+        utils.save_state_json(cursor_file, cursors)
+
+    return summary